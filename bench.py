@@ -0,0 +1,245 @@
+"""
+Offline micro-benchmarks for the selfbot's hot paths. Nothing here touches the network.
+
+    python bench.py          compare against the committed baseline (exit 1 on regression or if it is missing)
+    python bench.py --save   record a new baseline
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import tempfile
+
+import main
+from main import (
+    Bot, load_config, load_qrcode, percentile, build_arg_parser, get_uptime, reverse_text,
+    generate_minesweeper, compile_transforms, apply_transforms, split_message, generate_qr_code,
+)
+
+# ==================== BENCHMARKS ====================
+BENCH_BASELINE = os.environ.get("BENCH_BASELINE", "bench_baseline.json")
+BENCH_TOLERANCE = float(os.environ.get("BENCH_TOLERANCE", "0.25"))
+BENCH_UPTIME = 93784
+BENCH_SELF_ID = 1000
+BENCH_OTHER_ID = 2000
+BENCH_SLICE = 0.03
+BENCH_REPEATS = 15
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+        self.name = f"user{user_id}"
+        self.discriminator = "0"
+        self.mention = f"<@{user_id}>"
+    
+    def mentioned_in(self, message):
+        return self in message.mentions
+
+class FakeChannel:
+    def __init__(self, channel_id=1):
+        self.id = channel_id
+        self.sent = 0
+    
+    async def send(self, content=None, **kwargs):
+        self.sent += 1
+        return FakeMessage(content or "", FakeUser(BENCH_SELF_ID), self)
+
+class FakeMessage:
+    def __init__(self, content, author, channel):
+        self.id = 1
+        self.content = content
+        self.author = author
+        self.channel = channel
+        self.mentions = []
+        self.guild = None
+        self.edited = None
+    
+    async def edit(self, content=None, **kwargs):
+        # Keep .content intact so the same message can be routed again on the next iteration
+        self.edited = content
+    
+    async def delete(self):
+        pass
+    
+    async def reply(self, content=None, **kwargs):
+        return await self.channel.send(content)
+
+class FakeClient:
+    """Just enough of discord.Client for Bot.setup_events and CommandHandler"""
+    def __init__(self):
+        self.user = FakeUser(BENCH_SELF_ID)
+        self.latency = 0.042
+        self.guilds = []
+        self.events = {}
+    
+    def event(self, func):
+        self.events[func.__name__] = func
+        return func
+
+def reference_workload():
+    """Fixed pure-Python work timed alongside the cases, so results can be normalized for machine speed"""
+    table = {}
+    for i in range(200):
+        table[str(i)] = i * 2
+    return sum(table.values())
+
+def make_bench_bot(config):
+    """A real Bot wired to FakeClient, so the actual on_message closure and handler are exercised"""
+    bot = Bot(config, client=FakeClient())
+    bot.command_handler.refresh_filter()
+    return bot
+
+def build_benchmarks(bot):
+    """(name, callable, is_async) cases covering routing, dispatch and the pure helpers"""
+    handler = bot.command_handler
+    on_message = bot.bot.events["on_message"]
+    channel = FakeChannel()
+    me, other = bot.bot.user, FakeUser(BENCH_OTHER_ID)
+    chatter = FakeMessage("just some chatter in a busy channel", other, channel)
+    own_command = FakeMessage(".reverse hello world", me, channel)
+    foreign_command = FakeMessage(".ping", other, channel)
+    parse_screenshot = build_arg_parser({"--wait": "wait", "--size": "size"}, {"--fresh": "fresh", "--full": "full_page"})
+    screenshot_args = "https://example.com --wait idle --size 1920x1080 --full".split()
+    text = "The quick brown fox jumps over the lazy dog " * 4
+    text_args = text.split()
+    long_text = "Ping @everyone about the release notes\n" * 200
+    started = time.time() - BENCH_UPTIME
+    pipeline = compile_transforms("leet|reverse|hidemention")
+    return [
+        ("on_message drop (chatter)", lambda: on_message(chatter), True),
+        ("on_message drop (foreign command)", lambda: on_message(foreign_command), True),
+        ("on_message command (reverse)", lambda: on_message(own_command), True),
+        ("handle_command ping", lambda: handler.handle_command(own_command, "ping", []), True),
+        ("handle_command unknown", lambda: handler.handle_command(own_command, "nope", []), True),
+        ("split args", lambda: own_command.content[1:].split(), False),
+        ("parse options (screenshot)", lambda: parse_screenshot(screenshot_args), False),
+        ("get_uptime", lambda: get_uptime(started), False),
+        ("reverse_text", lambda: reverse_text(text), False),
+        ("leetpeek", lambda: handler.handle_command(own_command, "leetpeek", text_args), True),
+        ("minesweeper 9x9", lambda: handler.handle_command(own_command, "minesweeper", ["9", "9"]), True),
+        ("minesweeper board 15x11", lambda: generate_minesweeper(15, 11, 25, 1234), False),
+        ("transform leet|reverse|hidemention 8KB", lambda: apply_transforms(pipeline, long_text), False),
+        ("split_message 8KB", lambda: split_message(long_text), False),
+        ("generate_qr_code", lambda: generate_qr_code("https://example.com/bench"), False),
+    ]
+
+async def time_ops(func, is_async, count):
+    started = time.perf_counter()
+    if is_async:
+        for _ in range(count):
+            await func()
+    else:
+        for _ in range(count):
+            func()
+    return time.perf_counter() - started
+
+async def calibrate(func, is_async, target):
+    """Number of ops that takes roughly `target` seconds"""
+    count = 1
+    while True:
+        elapsed = await time_ops(func, is_async, count)
+        if elapsed >= target / 10:
+            return max(int(count * target / elapsed), 1)
+        count *= 10
+
+async def measure(func, is_async, reference_count):
+    """Best ops/sec, plus the median speed relative to the reference workload over BENCH_REPEATS slices.
+    The reference runs right before every slice so both see the same machine load; GC is paused like timeit."""
+    import gc
+    gc.disable()
+    try:
+        count = await calibrate(func, is_async, BENCH_SLICE)
+        best_ops = 0.0
+        scores = []
+        for _ in range(BENCH_REPEATS):
+            reference_ops = reference_count / await time_ops(reference_workload, False, reference_count)
+            ops = count / await time_ops(func, is_async, count)
+            best_ops = max(best_ops, ops)
+            scores.append(ops / reference_ops)
+        return best_ops, percentile(scores, 50), count
+    finally:
+        gc.enable()
+
+async def measure_allocations(func, is_async, count):
+    """Peak traced memory while running `count` ops and memory blocks still alive afterwards"""
+    import tracemalloc
+    import gc
+    gc.collect()
+    blocks_before = sys.getallocatedblocks()
+    tracemalloc.start()
+    try:
+        for _ in range(count):
+            if is_async:
+                await func()
+            else:
+                func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    gc.collect()
+    return peak, max(sys.getallocatedblocks() - blocks_before, 0)
+
+async def run_benchmarks_async(config, save, baseline_path=BENCH_BASELINE, tolerance=BENCH_TOLERANCE):
+    try:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+    except (OSError, ValueError):
+        baseline = {}
+    load_qrcode()
+    bot = make_bench_bot(config)
+    # Shared CI and VM hosts drift by tens of percent between runs, so cases are compared by their
+    # speed relative to a fixed reference workload timed next to them rather than by raw ops/sec
+    reference_count = await calibrate(reference_workload, False, BENCH_SLICE / 2)
+    results = {}
+    regressions = []
+    print(f"{'benchmark':<36}{'ops/sec':>12}{'peak KiB':>10}{'retained':>10}{'vs base':>10}")
+    for name, func, is_async in build_benchmarks(bot):
+        if name == "generate_qr_code" and not main.QR_AVAILABLE:
+            continue
+        ops, score, count = await measure(func, is_async, reference_count)
+        peak, retained = await measure_allocations(func, is_async, min(count, 2000))
+        results[name] = {"ops": ops, "score": score}
+        change = ""
+        if isinstance(baseline.get(name), dict):
+            ratio = score / baseline[name]["score"]
+            change = f"{(ratio - 1) * 100:+.0f}%"
+            if ratio < 1 - tolerance:
+                regressions.append(name)
+                change += " ❌"
+        print(f"{name:<36}{ops:>12,.0f}{peak / 1024:>10,.1f}{retained:>10}{change:>10}")
+    await handler_cleanup(bot.command_handler)
+    bot.state.close()
+    if save:
+        os.makedirs(os.path.dirname(baseline_path) or ".", exist_ok=True)
+        with open(baseline_path, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"💾 Baseline saved to {baseline_path}")
+        return 0
+    if not baseline:
+        print(f"❌ No baseline at {baseline_path}, run with --save to record one")
+        return 1
+    if regressions:
+        print(f"❌ {len(regressions)} regressed more than {tolerance * 100:.0f}% vs {baseline_path}: {', '.join(regressions)}")
+        return 1
+    print("✅ No regressions")
+    return 0
+
+async def handler_cleanup(handler):
+    handler.qr_renderer.close()
+    await handler.http.close()
+
+def run_benchmarks(save=False):
+    config = load_config()
+    config["token"] = "bench.fake.token"
+    config["prefix"] = "."
+    # Only BENCH_SELF_ID and this user may run commands, so foreign commands take the drop path
+    config["remote-users"] = ["3000"]
+    # Keep the run free of disk writes and background flushes, and of any state a real session persisted
+    config["message_index"]["enabled"] = False
+    config["state"]["path"] = os.path.join(tempfile.mkdtemp(prefix="selfbot-bench-"), "state.json")
+    return asyncio.run(run_benchmarks_async(config, save))
+
+if __name__ == "__main__":
+    sys.exit(run_benchmarks(save="--save" in sys.argv))
@@ -0,0 +1,403 @@
+"""
+Load test for the selfbot: runs the real Bot against a local stand-in for the Discord gateway and REST API.
+
+    python loadtest.py [--rate 20] [--duration 15] [--mix "ping:3,reverse hi:2,chatter:5"] [--rate-limit 50] [--port 8790]
+"""
+
+import os
+import sys
+import re
+import json
+import time
+import zlib
+import base64
+import random
+import hashlib
+import asyncio
+import tempfile
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+import aiohttp
+
+from main import Bot, PREFIX, percentile
+
+# ==================== FAKE DISCORD ====================
+DISCORD_EPOCH = 1420070400000
+FAKE_SELF_ID = 100000000000000001
+FAKE_FRIEND_ID = 100000000000000002
+FAKE_CHANNEL_ID = 100000000000000003
+FAKE_HEARTBEAT_MS = 41250
+FAKE_ROUTE_ID_RE = re.compile(r"/\d{5,}")
+LOADTEST_DEFAULT_MIX = "ping:3,reverse hello world:2,uptime:1,chatter:6"
+
+def fake_user(user_id, name):
+    return {"id": str(user_id), "username": name, "discriminator": "0", "global_name": name, "avatar": None, "public_flags": 0}
+
+class FakeDiscord:
+    """Minimal Discord: a zlib-stream gateway (HELLO/IDENTIFY/READY/MESSAGE_CREATE/heartbeats) and REST
+    endpoints for sending, editing, deleting and paging messages, with per-route rate-limit headers"""
+    def __init__(self, rate_limit=50, rate_window=1.0):
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.self_user = dict(fake_user(FAKE_SELF_ID, "loadtest"), email=None, verified=True, mfa_enabled=False, flags=0, premium_type=0, phone=None, bio="")
+        self.friend = fake_user(FAKE_FRIEND_ID, "friend")
+        self.messages = {FAKE_CHANNEL_ID: OrderedDict()}
+        self.sockets = []
+        self.ready = asyncio.Event()
+        self.sequence = 0
+        self.counter = 0
+        self.buckets = {}
+        self.waiting = {}
+        self.latencies = []
+        self.stats = {"rest": {}, "rate_limited": 0, "unhandled": {}, "events": 0}
+        self.runner = None
+    
+    def snowflake(self):
+        self.counter = (self.counter + 1) & 0xFFF
+        return ((int(time.time() * 1000) - DISCORD_EPOCH) << 22) | self.counter
+    
+    def message_payload(self, channel_id, author, content, message_id=None):
+        return {
+            "id": str(message_id or self.snowflake()), "channel_id": str(channel_id), "author": author, "content": content,
+            "timestamp": datetime.now(timezone.utc).isoformat(), "edited_timestamp": None, "tts": False,
+            "mention_everyone": False, "mentions": [], "mention_roles": [], "attachments": [], "embeds": [],
+            "pinned": False, "type": 0, "flags": 0, "components": [],
+        }
+    
+    # ----- gateway -----
+    async def send_event(self, ws, compressor, payload):
+        data = json.dumps(payload).encode()
+        await ws.send_bytes(compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH))
+    
+    async def dispatch(self, event, data):
+        self.sequence += 1
+        self.stats["events"] += 1
+        for ws, compressor in list(self.sockets):
+            try:
+                await self.send_event(ws, compressor, {"op": 0, "t": event, "s": self.sequence, "d": data})
+            except ConnectionError:
+                pass
+    
+    async def handle_gateway(self, request):
+        from aiohttp import web
+        # The client advertises permessage-deflate but never enables it; payloads are zlib-streamed instead
+        ws = web.WebSocketResponse(max_msg_size=0, compress=False)
+        await ws.prepare(request)
+        compressor = zlib.compressobj()
+        await self.send_event(ws, compressor, {"op": 10, "d": {"heartbeat_interval": FAKE_HEARTBEAT_MS}})
+        try:
+            async for msg in ws:
+                if msg.type != aiohttp.WSMsgType.TEXT:
+                    continue
+                payload = json.loads(msg.data)
+                if payload.get("op") == 1:
+                    await self.send_event(ws, compressor, {"op": 11})
+                elif payload.get("op") == 2:
+                    self.sockets.append((ws, compressor))
+                    await self.send_ready(ws, compressor)
+        finally:
+            self.sockets = [entry for entry in self.sockets if entry[0] is not ws]
+        return ws
+    
+    async def send_ready(self, ws, compressor):
+        self.sequence += 1
+        ready = {
+            "v": 9, "user": self.self_user, "users": [self.friend], "guilds": [], "relationships": [],
+            "private_channels": [{"id": str(FAKE_CHANNEL_ID), "type": 1, "recipient_ids": [str(FAKE_FRIEND_ID)], "last_message_id": None}],
+            "session_id": "loadtest", "resume_gateway_url": str(ws_url_for(self)), "user_settings_proto": "",
+        }
+        await self.send_event(ws, compressor, {"op": 0, "t": "READY", "s": self.sequence, "d": ready})
+        self.sequence += 1
+        supplemental = {"guilds": [], "merged_members": [], "merged_presences": {"guilds": [], "friends": []}, "lazy_private_channels": []}
+        await self.send_event(ws, compressor, {"op": 0, "t": "READY_SUPPLEMENTAL", "s": self.sequence, "d": supplemental})
+        self.ready.set()
+    
+    async def inject(self, author, content, channel_id=FAKE_CHANNEL_ID, track=False):
+        """Deliver a MESSAGE_CREATE as if someone typed it; tracked messages are timed until the bot answers"""
+        payload = self.message_payload(channel_id, author, content)
+        self.messages.setdefault(channel_id, OrderedDict())[int(payload["id"])] = payload
+        if track:
+            self.waiting[int(payload["id"])] = time.perf_counter()
+        await self.dispatch("MESSAGE_CREATE", payload)
+        return int(payload["id"])
+    
+    def answered(self, message_id):
+        started = self.waiting.pop(message_id, None)
+        if started is not None:
+            self.latencies.append(time.perf_counter() - started)
+    
+    # ----- REST -----
+    def rate_limit_headers(self, bucket):
+        now = time.monotonic()
+        state = self.buckets.get(bucket)
+        if state is None or now >= state["reset_at"]:
+            state = self.buckets[bucket] = {"remaining": self.rate_limit, "reset_at": now + self.rate_window}
+        reset_after = max(state["reset_at"] - now, 0)
+        if state["remaining"] <= 0:
+            return None, reset_after
+        state["remaining"] -= 1
+        return {
+            "X-RateLimit-Limit": str(self.rate_limit),
+            "X-RateLimit-Remaining": str(state["remaining"]),
+            "X-RateLimit-Reset": f"{time.time() + reset_after:.3f}",
+            "X-RateLimit-Reset-After": f"{reset_after:.3f}",
+            "X-RateLimit-Bucket": hashlib.sha1(bucket.encode()).hexdigest()[:16],
+        }, reset_after
+    
+    async def handle_rest(self, request):
+        from aiohttp import web
+        path = request.match_info["path"]
+        route = f"{request.method} /{FAKE_ROUTE_ID_RE.sub('/{id}', '/' + path).lstrip('/')}"
+        self.stats["rest"][route] = self.stats["rest"].get(route, 0) + 1
+        headers, reset_after = self.rate_limit_headers(f"{request.method} {path.split('/messages')[0]}")
+        if headers is None:
+            self.stats["rate_limited"] += 1
+            body = {"message": "You are being rate limited.", "retry_after": reset_after, "global": False}
+            headers = {"Retry-After": f"{reset_after:.3f}", "X-RateLimit-Scope": "user"}
+            status = 429
+        else:
+            status, body = await self.route_rest(request, path.strip("/").split("/"))
+            if status == 204:
+                return web.Response(status=204, headers=headers)
+        # discord.py only decodes bodies whose Content-Type is exactly application/json, without a charset
+        headers["Content-Type"] = "application/json"
+        return web.Response(body=json.dumps(body).encode(), status=status, headers=headers)
+    
+    async def read_payload(self, request):
+        if request.content_type.startswith("multipart/"):
+            form = await request.post()
+            return json.loads(form.get("payload_json", "{}"))
+        try:
+            return await request.json()
+        except ValueError:
+            return {}
+    
+    async def route_rest(self, request, parts):
+        method = request.method
+        if parts == ["users", "@me"]:
+            return 200, self.self_user
+        if parts == ["gateway"]:
+            return 200, {"url": str(ws_url_for(self))}
+        if len(parts) >= 2 and parts[0] == "channels" and parts[1].isdigit():
+            channel_id = int(parts[1])
+            channel = self.messages.setdefault(channel_id, OrderedDict())
+            if len(parts) == 2 and method == "GET":
+                return 200, {"id": str(channel_id), "type": 1, "recipients": [self.friend], "last_message_id": None}
+            if len(parts) == 3 and parts[2] == "messages":
+                if method == "POST":
+                    payload = await self.read_payload(request)
+                    message = self.message_payload(channel_id, self.self_user, payload.get("content") or "")
+                    channel[int(message["id"])] = message
+                    reference = (payload.get("message_reference") or {}).get("message_id")
+                    if reference:
+                        self.answered(int(reference))
+                    await self.dispatch("MESSAGE_CREATE", message)
+                    return 200, message
+                if method == "GET":
+                    return 200, self.history(channel, request.query)
+            if len(parts) == 4 and parts[2] == "messages" and parts[3].isdigit():
+                message_id = int(parts[3])
+                message = channel.get(message_id)
+                if message is None:
+                    return 404, {"message": "Unknown Message", "code": 10008}
+                if method == "PATCH":
+                    payload = await self.read_payload(request)
+                    if "content" in payload:
+                        message["content"] = payload["content"]
+                    message["edited_timestamp"] = datetime.now(timezone.utc).isoformat()
+                    self.answered(message_id)
+                    return 200, message
+                if method == "DELETE":
+                    del channel[message_id]
+                    self.answered(message_id)
+                    return 204, None
+                if method == "GET":
+                    return 200, message
+        key = f"{method} /{'/'.join(parts)}"
+        self.stats["unhandled"][key] = self.stats["unhandled"].get(key, 0) + 1
+        return 200, {}
+    
+    @staticmethod
+    def history(channel, query):
+        """Newest-first paging with before/after/limit, like GET /channels/{id}/messages"""
+        limit = min(int(query.get("limit", "50")), 100)
+        before = int(query.get("before", "0")) or None
+        after = int(query.get("after", "0")) or None
+        ids = sorted(channel, reverse=True)
+        if before:
+            ids = [message_id for message_id in ids if message_id < before]
+        if after:
+            ids = sorted(message_id for message_id in ids if message_id > after)[:limit][::-1]
+        return [channel[message_id] for message_id in ids[:limit]]
+    
+    async def start(self, host, port):
+        from aiohttp import web
+        app = web.Application()
+        app.router.add_get("/gateway", self.handle_gateway)
+        app.router.add_route("*", "/api/v{version}/{path:.*}", self.handle_rest)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+        self.host, self.port = host, port
+    
+    async def close(self):
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
+
+def ws_url_for(fake):
+    return f"ws://{fake.host}:{fake.port}/gateway"
+
+# ==================== LOAD TEST ====================
+def parse_load_mix(spec):
+    """'ping:3,reverse hi:2,chatter:5' -> (text, is_command, weight) choices; 'chatter' is non-command traffic"""
+    choices = []
+    for item in spec.split(","):
+        text, _, weight = item.strip().rpartition(":")
+        if not text:
+            text, weight = weight, "1"
+        command = text.strip() != "chatter"
+        choices.append((text.strip(), command, max(int(weight), 1)))
+    return choices
+
+class LoadDriver:
+    """Open-loop load: injects messages at a fixed rate regardless of how fast the bot keeps up"""
+    def __init__(self, fake, prefix, rate=20.0, duration=15.0, mix=LOADTEST_DEFAULT_MIX, drain=10.0):
+        self.fake = fake
+        self.prefix = prefix
+        self.rate = rate
+        self.duration = duration
+        self.choices = parse_load_mix(mix)
+        self.drain = drain
+        self.sent = {"commands": 0, "chatter": 0}
+        self.elapsed = 0.0
+        self.finished = False
+    
+    async def run(self, ready_timeout=60):
+        await asyncio.wait_for(self.fake.ready.wait(), ready_timeout)
+        # Give on_ready a moment to finish before the first command arrives
+        await asyncio.sleep(0.5)
+        weights = [weight for _, _, weight in self.choices]
+        interval = 1 / self.rate
+        started = time.perf_counter()
+        deadline = started + self.duration
+        next_at = started
+        while next_at < deadline:
+            text, is_command, _ = random.choices(self.choices, weights)[0]
+            if is_command:
+                await self.fake.inject(self.fake.self_user, self.prefix + text, track=True)
+                self.sent["commands"] += 1
+            else:
+                await self.fake.inject(self.fake.friend, "just some chatter in a busy channel")
+                self.sent["chatter"] += 1
+            next_at += interval
+            await asyncio.sleep(max(next_at - time.perf_counter(), 0))
+        self.elapsed = time.perf_counter() - started
+        drain_deadline = time.perf_counter() + self.drain
+        while self.fake.waiting and time.perf_counter() < drain_deadline:
+            await asyncio.sleep(0.05)
+        self.finished = True
+        await self.fake.inject(self.fake.self_user, self.prefix + "shutdown")
+    
+    def report(self):
+        latencies = self.fake.latencies
+        completed = len(latencies)
+        lines = [
+            f"📦 Sent {self.sent['commands']} commands + {self.sent['chatter']} chatter in {self.elapsed:.1f}s (target {self.rate:g}/s)",
+            f"✅ {completed} answered, {len(self.fake.waiting)} unanswered | {completed / max(self.elapsed, 1e-6):.1f} commands/s",
+        ]
+        if latencies:
+            lines.append("⏱️ End-to-end latency: " + " | ".join(f"p{pct} {percentile(latencies, pct) * 1000:.1f}ms" for pct in (50, 95, 99)) + f" | max {max(latencies) * 1000:.1f}ms")
+        lines.append(f"🌐 REST calls: {sum(self.fake.stats['rest'].values())} ({self.fake.stats['rate_limited']} rate limited), gateway events: {self.fake.stats['events']}")
+        for route, count in sorted(self.fake.stats["rest"].items(), key=lambda item: -item[1])[:8]:
+            lines.append(f"   {count:>6}  {route}")
+        if self.fake.stats["unhandled"]:
+            lines.append("ℹ️  Stubbed routes: " + ", ".join(sorted(self.fake.stats["unhandled"])))
+        return "\n".join(lines)
+
+def argv_option(name, default):
+    if name in sys.argv:
+        index = sys.argv.index(name)
+        if index + 1 < len(sys.argv):
+            return sys.argv[index + 1]
+    return default
+
+def use_static_client_info():
+    """Client properties normally come from a third-party API, which an isolated test host cannot reach"""
+    from discord import utils as discord_utils
+    
+    async def static_client_info(session):
+        properties = {
+            "os": "Windows", "browser": "Chrome", "device": "", "system_locale": "en-US",
+            "browser_user_agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+            "browser_version": "120.0.0.0", "os_version": "10", "referrer": "", "referring_domain": "",
+            "referrer_current": "", "referring_domain_current": "", "release_channel": "stable",
+            "client_build_number": 9999, "client_event_source": None, "design_id": 0,
+        }
+        return properties, base64.b64encode(json.dumps(properties).encode()).decode()
+    
+    discord_utils._get_info = static_client_info
+
+def run_load_test():
+    """Start FakeDiscord and a LoadDriver in a side thread, then run the real Bot against them"""
+    host, port = "127.0.0.1", int(argv_option("--port", "8790"))
+    rate = float(argv_option("--rate", "20"))
+    duration = float(argv_option("--duration", "15"))
+    mix = argv_option("--mix", LOADTEST_DEFAULT_MIX)
+    rate_limit = int(argv_option("--rate-limit", "50"))
+    scratch = tempfile.mkdtemp(prefix="selfbot-loadtest-")
+    os.environ.update({
+        "TOKEN": "loadtest.fake.token",
+        "DISCORD_API_BASE": f"http://{host}:{port}",
+        "DISCORD_GATEWAY": f"ws://{host}:{port}/gateway",
+        # Keep test traffic out of the real state, index and deletion files, and skip browser warmup
+        "STATE_PATH": os.path.join(scratch, "state.json"),
+        "MESSAGE_INDEX": os.path.join(scratch, "messages.db"),
+        "DELETION_STATE": os.path.join(scratch, "deletions.json"),
+        "SELENIUM_PREWARM": "false",
+    })
+    fake = None
+    driver = None
+    server = {}
+    failure = []
+    server_ready = threading.Event()
+    
+    async def serve():
+        nonlocal fake, driver
+        fake = FakeDiscord(rate_limit=rate_limit)
+        await fake.start(host, port)
+        driver = LoadDriver(fake, PREFIX or os.environ.get("PREFIX", "."), rate, duration, mix)
+        server["loop"] = asyncio.get_running_loop()
+        server["task"] = asyncio.current_task()
+        server_ready.set()
+        try:
+            await driver.run()
+            # Let the shutdown command go through before the server disappears
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            if not driver.finished:
+                failure.append(RuntimeError("bot exited before the load finished"))
+        except Exception as e:
+            failure.append(e)
+        finally:
+            await fake.close()
+    
+    use_static_client_info()
+    thread = threading.Thread(target=lambda: asyncio.run(serve()), name="fake-discord", daemon=True)
+    thread.start()
+    server_ready.wait(10)
+    print(f"🧪 Load test: {rate:g} msg/s for {duration:g}s against fake Discord on {host}:{port}")
+    Bot().run()
+    if thread.is_alive() and "task" in server:
+        server["loop"].call_soon_threadsafe(server["task"].cancel)
+    thread.join(30)
+    if failure:
+        print(f"❌ Load test failed: {type(failure[0]).__name__}: {failure[0]}")
+        return 1
+    print(driver.report())
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(run_load_test())
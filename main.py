@@ -15,33 +15,50 @@ PREFIX = "."  # Command prefix
 
 import os
 import sys
+import time
 import subprocess
+import importlib.util
+
+# ==================== STARTUP PROFILE ====================
+STARTUP_PROFILE = "--startup-profile" in sys.argv
+STARTUP_MARKS = [("start", time.perf_counter())]
+
+def startup_mark(label):
+    """Record the end of a startup phase when --startup-profile is on"""
+    if STARTUP_PROFILE:
+        STARTUP_MARKS.append((label, time.perf_counter()))
+
+def print_startup_profile():
+    if not STARTUP_PROFILE or len(STARTUP_MARKS) < 2:
+        return
+    print("⏱️  Startup profile:")
+    for (_, previous), (label, moment) in zip(STARTUP_MARKS, STARTUP_MARKS[1:]):
+        print(f"   {label:<24}{(moment - previous) * 1000:>9.1f} ms")
+    print(f"   {'total':<24}{(STARTUP_MARKS[-1][1] - STARTUP_MARKS[0][1]) * 1000:>9.1f} ms")
 
 # ==================== AUTO INSTALL DEPENDENCIES ====================
+def module_available(name):
+    """Check a module can be imported without executing it"""
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
 def install_requirements():
     """Auto-install missing packages"""
     required_packages = {
-        "discord.py-self": "discord.py-self==2.0.0",
-        "audioop_lts": "audioop-lts>=0.2.2",
+        "discord": "discord.py-self==2.0.0",
+        "audioop": "audioop-lts>=0.2.2",
         "selenium": "selenium==4.15.2",
         "webdriver_manager": "webdriver-manager==4.0.1",
-        "requests": "requests==2.31.0",
         "PIL": "Pillow>=10.4.0",
         "qrcode": "qrcode==7.4.2",
         "aiohttp": "aiohttp>=3.11.0",
+        "lxml": "lxml>=5.3.0",
+        "cssselect": "cssselect>=1.2.0",
     }
     
-    missing = []
-    for module, package in required_packages.items():
-        try:
-            if module == "PIL":
-                __import__("PIL")
-            elif module == "audioop_lts":
-                __import__("audioop")
-            else:
-                __import__(module.replace("-", "_"))
-        except ImportError:
-            missing.append(package)
+    missing = [package for module, package in required_packages.items() if not module_available(module)]
     
     if missing:
         print("📦 Installing missing packages...")
@@ -53,46 +70,112 @@ def install_requirements():
             print("⚠️  Some packages failed to install. You may need to install them manually:")
             print(f"   pip install {' '.join(missing)}")
             print("   Continuing anyway...")
+        importlib.invalidate_caches()
 
-# Install dependencies before importing
-install_requirements()
+# Install dependencies before importing, but only when run as the bot: bench.py and loadtest.py import this module
+if __name__ == "__main__":
+    install_requirements()
+startup_mark("dependency check")
 
 import asyncio
-import time
 import json
 import random
 import string
 import re
 import io
-import requests
+import socket
+import ssl
+import sqlite3
+import hashlib
+import threading
+import contextvars
+import traceback
+import bisect
+import weakref
 import aiohttp
 from typing import Optional, Dict, Any, List
-from datetime import datetime
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from urllib.parse import urlsplit, urlunsplit, urljoin, parse_qsl, urlencode
+startup_mark("stdlib + aiohttp")
 
 # Discord
 import discord
+startup_mark("discord")
 
-# QR Code
-try:
-    import qrcode
-    from PIL import Image
-    QR_AVAILABLE = True
-except:
-    QR_AVAILABLE = False
-
-# Selenium (optional - only if available)
-try:
-    from selenium import webdriver
-    from selenium.webdriver.chrome.service import Service
-    from selenium.webdriver.chrome.options import Options
-    from selenium.webdriver.common.by import By
-    from selenium.webdriver.support.ui import WebDriverWait
-    from selenium.webdriver.support import expected_conditions as EC
-    from selenium.common.exceptions import TimeoutException, NoSuchElementException
-    from webdriver_manager.chrome import ChromeDriverManager
-    SELENIUM_AVAILABLE = True
-except:
-    SELENIUM_AVAILABLE = False
+# ==================== LAZY IMPORTS ====================
+# Heavy optional modules are only probed here and imported by the first command that needs them
+PIL_AVAILABLE = module_available("PIL")
+QR_AVAILABLE = PIL_AVAILABLE and module_available("qrcode")
+HTML_PARSER_AVAILABLE = module_available("lxml") and module_available("cssselect")
+SELENIUM_AVAILABLE = module_available("selenium")
+
+Image = None
+qrcode = None
+lxml = None
+CSSSelector = None
+webdriver = Service = Options = By = WebDriverWait = EC = TimeoutException = WebDriverException = ChromeDriverManager = None
+
+def lazy_import_timer(name, started):
+    if STARTUP_PROFILE:
+        print(f"⏱️  lazy import {name}: {(time.perf_counter() - started) * 1000:.1f} ms")
+
+def load_pil():
+    global Image, PIL_AVAILABLE, QR_AVAILABLE
+    if Image is None and PIL_AVAILABLE:
+        started = time.perf_counter()
+        try:
+            from PIL import Image
+        except Exception:
+            PIL_AVAILABLE = QR_AVAILABLE = False
+        lazy_import_timer("PIL", started)
+    return PIL_AVAILABLE
+
+def load_qrcode():
+    global qrcode, QR_AVAILABLE
+    if qrcode is None and QR_AVAILABLE and load_pil():
+        started = time.perf_counter()
+        try:
+            import qrcode
+        except Exception:
+            QR_AVAILABLE = False
+        lazy_import_timer("qrcode", started)
+    return QR_AVAILABLE
+
+def load_html_parser():
+    global lxml, CSSSelector, HTML_PARSER_AVAILABLE
+    if CSSSelector is None and HTML_PARSER_AVAILABLE:
+        started = time.perf_counter()
+        try:
+            import lxml.html
+            from lxml.cssselect import CSSSelector
+        except Exception:
+            HTML_PARSER_AVAILABLE = False
+        lazy_import_timer("lxml", started)
+    return HTML_PARSER_AVAILABLE
+
+def load_selenium():
+    global webdriver, Service, Options, By, WebDriverWait, EC, TimeoutException, WebDriverException, ChromeDriverManager, SELENIUM_AVAILABLE
+    if webdriver is None and SELENIUM_AVAILABLE:
+        started = time.perf_counter()
+        try:
+            from selenium import webdriver
+            from selenium.webdriver.chrome.service import Service
+            from selenium.webdriver.chrome.options import Options
+            from selenium.webdriver.common.by import By
+            from selenium.webdriver.support.ui import WebDriverWait
+            from selenium.webdriver.support import expected_conditions as EC
+            from selenium.common.exceptions import TimeoutException, WebDriverException
+        except Exception:
+            SELENIUM_AVAILABLE = False
+        try:
+            from webdriver_manager.chrome import ChromeDriverManager
+        except Exception:
+            pass
+        lazy_import_timer("selenium", started)
+    return SELENIUM_AVAILABLE
 
 # ==================== DISCORD PATCH ====================
 def patch_discord_state():
@@ -101,33 +184,71 @@ def patch_discord_state():
         original_parse_ready_supplemental = discord_state.ConnectionState.parse_ready_supplemental
         
         def patched_parse_ready_supplemental(self, data):
-            """Patched version - synchronous to match original call"""
-            pending_payments_raw = data.get('pending_payments')
-            pending_payments_data = pending_payments_raw if pending_payments_raw is not None else []
-            try:
-                Payment = getattr(discord_state, 'Payment', None)
-                if Payment:
-                    self.pending_payments = {int(p['id']): Payment(state=self, data=p) for p in pending_payments_data}
-                else:
-                    self.pending_payments = {int(p['id']): p for p in pending_payments_data if p and 'id' in p}
-            except:
-                self.pending_payments = {}
-            
-            connected_accounts_raw = data.get('connected_accounts')
-            connected_accounts_data = connected_accounts_raw if connected_accounts_raw is not None else []
-            try:
-                ConnectedAccount = getattr(discord_state, 'ConnectedAccount', None)
-                if ConnectedAccount:
-                    self.connected_accounts = {int(acc['id']): ConnectedAccount(state=self, data=acc) for acc in connected_accounts_data}
-                else:
-                    self.connected_accounts = {int(acc['id']): acc for acc in connected_accounts_data if acc and 'id' in acc}
-            except:
-                self.connected_accounts = {}
+            """Discord can send null pending_payments/connected_accounts, which the library iterates directly"""
+            for payload in (getattr(self, "_ready_data", None), data):
+                if not isinstance(payload, dict):
+                    continue
+                for key in ("pending_payments", "connected_accounts"):
+                    if key in payload and payload[key] is None:
+                        payload[key] = []
+            return original_parse_ready_supplemental(self, data)
         
         discord_state.ConnectionState.parse_ready_supplemental = patched_parse_ready_supplemental
     except:
         pass
 
+def point_discord_at(api_base=None, gateway_url=None):
+    """Send REST and gateway traffic somewhere other than discord.com (a proxy, or the fake server in loadtest.py)"""
+    if not api_base and not gateway_url:
+        return
+    import yarl
+    from discord import http as discord_http, gateway as discord_gateway
+    if api_base:
+        discord_http.Route.BASE = f"{api_base.rstrip('/')}/api/v{discord_http.INTERNAL_API_VERSION}"
+    if gateway_url:
+        discord_gateway.DiscordWebSocket.DEFAULT_GATEWAY = yarl.URL(gateway_url)
+
+def disable_presence_tracking(client):
+    """Keep no Presence objects: drop PRESENCE_UPDATE events, strip the presences that READY_SUPPLEMENTAL
+    merges into every guild, and make the store a no-op for the ones that still arrive with members"""
+    try:
+        connection = client._connection
+        parsers = connection.parsers
+        original_ready_supplemental = parsers["READY_SUPPLEMENTAL"]
+        
+        def ready_supplemental_without_presences(data):
+            merged = data.get("merged_presences") or {}
+            # One (empty) list per guild: the library zips these with the guild list, so it must keep its length
+            data["merged_presences"] = {"guilds": [[] for _ in merged.get("guilds", [])], "friends": []}
+            for guild in (getattr(connection, "_ready_data", None) or {}).get("guilds", []):
+                guild.pop("presences", None)
+            return original_ready_supplemental(data)
+        
+        parsers["READY_SUPPLEMENTAL"] = ready_supplemental_without_presences
+        parsers["PRESENCE_UPDATE"] = lambda data: None
+        connection.store_presence = lambda user_id, presence, guild_id=None: presence
+        connection._presences.clear()
+        connection._guild_presences.clear()
+    except (AttributeError, KeyError) as e:
+        print(f"⚠️  Could not disable presence tracking ({type(e).__name__}: {e}), presences will be cached")
+
+def build_client_options(cache_config):
+    """Translate the client cache policy into discord.Client keyword arguments"""
+    members = cache_config.get("members", "all")
+    if members == "none":
+        member_flags = discord.MemberCacheFlags.none()
+    elif members == "voice":
+        member_flags = discord.MemberCacheFlags(voice=True, other=False)
+    else:
+        member_flags = discord.MemberCacheFlags.all()
+    return {
+        # The library treats max_messages <= 0 as "use the default", None disables the cache
+        "max_messages": cache_config.get("max_messages", 1000) or None,
+        "member_cache_flags": member_flags,
+        "chunk_guilds_at_startup": cache_config.get("chunk_guilds", True),
+        "request_guilds": cache_config.get("request_guilds", True),
+    }
+
 # ==================== CONFIG ====================
 def load_config():
     """Load config from main.py variables, environment, or defaults"""
@@ -138,16 +259,290 @@ def load_config():
         "token": token.strip() if token else "",
         "prefix": PREFIX if PREFIX else (os.environ.get("PREFIX", ".")),
         "remote-users": os.environ.get("REMOTE_USERS", "").split(",") if os.environ.get("REMOTE_USERS") else [],
-        "selenium": {"headless": os.environ.get("SELENIUM_HEADLESS", "true").lower() == "true"}
+        "upload_limit": int(os.environ.get("UPLOAD_LIMIT_MB", "10")) * 1024 * 1024,
+        "client_cache": {
+            "max_messages": int(os.environ.get("CACHE_MAX_MESSAGES", "1000")),
+            "members": os.environ.get("CACHE_MEMBERS", "all").lower(),
+            "chunk_guilds": os.environ.get("CACHE_CHUNK_GUILDS", "true").lower() == "true",
+            "request_guilds": os.environ.get("CACHE_REQUEST_GUILDS", "true").lower() == "true",
+            "presences": os.environ.get("CACHE_PRESENCES", "true").lower() == "true",
+        },
+        "deletion": {
+            "state_path": os.environ.get("DELETION_STATE", os.path.join("data", "deletions.json")),
+            "scan_factor": int(os.environ.get("DELETION_SCAN_FACTOR", "20")),
+        },
+        "discord_api": {
+            "base": os.environ.get("DISCORD_API_BASE", ""),
+            "gateway": os.environ.get("DISCORD_GATEWAY", ""),
+        },
+        "state": {
+            "path": os.environ.get("STATE_PATH", os.path.join("data", "state.json")),
+            "flush_delay": float(os.environ.get("STATE_FLUSH_DELAY", "0.5")),
+            "compact_every": int(os.environ.get("STATE_COMPACT_EVERY", "200")),
+        },
+        "qr": {
+            "workers": int(os.environ.get("QR_WORKERS", "2")),
+            "cache_size": int(os.environ.get("QR_CACHE_SIZE", "128")),
+        },
+        "loop_monitor": {
+            "enabled": os.environ.get("LOOP_MONITOR", "true").lower() == "true",
+            "interval": float(os.environ.get("LOOP_MONITOR_INTERVAL", "0.1")),
+            "threshold_ms": float(os.environ.get("LOOP_STALL_MS", "100")),
+        },
+        "metrics": {
+            "host": os.environ.get("METRICS_HOST", "127.0.0.1"),
+            "port": int(os.environ.get("METRICS_PORT", "0")),
+        },
+        "scheduler": {
+            "limits": {
+                "cheap": int(os.environ.get("SCHEDULER_CHEAP_LIMIT", "32")),
+                "network": int(os.environ.get("SCHEDULER_NETWORK_LIMIT", "4")),
+                "bulk": int(os.environ.get("SCHEDULER_BULK_LIMIT", "2")),
+                "browser": int(os.environ.get("SCHEDULER_BROWSER_LIMIT", "2")),
+            },
+            "timeouts": {
+                "cheap": float(os.environ.get("SCHEDULER_CHEAP_TIMEOUT", "30")),
+                "network": float(os.environ.get("SCHEDULER_NETWORK_TIMEOUT", "90")),
+                "bulk": float(os.environ.get("SCHEDULER_BULK_TIMEOUT", "3600")),
+                "browser": float(os.environ.get("SCHEDULER_BROWSER_TIMEOUT", "180")),
+            },
+            "max_queue": int(os.environ.get("SCHEDULER_MAX_QUEUE", "16")),
+        },
+        "edits": {
+            "grace": float(os.environ.get("EDIT_GRACE", "0.5")),
+            "interval": float(os.environ.get("EDIT_INTERVAL", "1.0")),
+        },
+        "message_index": {
+            "enabled": os.environ.get("MESSAGE_INDEX_ENABLED", "true").lower() == "true",
+            "path": os.environ.get("MESSAGE_INDEX", os.path.join("data", "messages.db")),
+            "flush_interval": float(os.environ.get("MESSAGE_INDEX_FLUSH", "2")),
+            "backfill_limit": int(os.environ.get("MESSAGE_INDEX_BACKFILL", "1000")),
+        },
+        "selenium": {
+            "headless": os.environ.get("SELENIUM_HEADLESS", "true").lower() == "true",
+            "pool_size": int(os.environ.get("SELENIUM_POOL_SIZE", "2")),
+            "max_waiters": int(os.environ.get("SELENIUM_QUEUE_SIZE", "8")),
+            "job_timeout": float(os.environ.get("SELENIUM_JOB_TIMEOUT", "60")),
+            "queue_timeout": float(os.environ.get("SELENIUM_QUEUE_TIMEOUT", "30")),
+            "prewarm": os.environ.get("SELENIUM_PREWARM", "true").lower() == "true",
+            "wait": os.environ.get("SELENIUM_WAIT", "ready"),
+            "wait_timeout": float(os.environ.get("SELENIUM_WAIT_TIMEOUT", "15")),
+            "viewport": os.environ.get("SELENIUM_VIEWPORT", "1280x800"),
+        },
+        "http": {
+            "limit": int(os.environ.get("HTTP_POOL_SIZE", "100")),
+            "limit_per_host": int(os.environ.get("HTTP_POOL_PER_HOST", "10")),
+            "dns_ttl": int(os.environ.get("HTTP_DNS_TTL", "300")),
+            "keepalive": float(os.environ.get("HTTP_KEEPALIVE", "30")),
+            "timeout": float(os.environ.get("HTTP_TIMEOUT", "30")),
+            "connect_timeout": float(os.environ.get("HTTP_CONNECT_TIMEOUT", "10")),
+        },
+        "geoip": {
+            "backend": os.environ.get("GEOIP_BACKEND", "ip-api"),
+            "api_url": os.environ.get("GEOIP_API_URL", "http://ip-api.com"),
+            "mmdb_path": os.environ.get("GEOIP_MMDB", ""),
+            "cache_path": os.environ.get("GEOIP_CACHE", os.path.join("data", "geoip.db")),
+            "ttl": int(os.environ.get("GEOIP_TTL", "86400")),
+            "max_entries": int(os.environ.get("GEOIP_CACHE_SIZE", "1024")),
+        },
+        "capture_cache": {
+            "path": os.environ.get("CAPTURE_CACHE", os.path.join("data", "captures.db")),
+            "ttl": int(os.environ.get("CAPTURE_CACHE_TTL", "3600")),
+            "max_bytes": int(os.environ.get("CAPTURE_CACHE_MB", "200")) * 1024 * 1024,
+        },
+        "download": {
+            "dir": os.environ.get("DOWNLOAD_DIR", "temp"),
+            "max_bytes": int(os.environ.get("DOWNLOAD_MAX_MB", "100")) * 1024 * 1024,
+            "segments": int(os.environ.get("DOWNLOAD_SEGMENTS", "4")),
+            "segment_threshold": int(os.environ.get("DOWNLOAD_SEGMENT_MB", "8")) * 1024 * 1024,
+            "allowed_types": [t.strip().lower() for t in os.environ.get("DOWNLOAD_ALLOWED_TYPES", "").split(",") if t.strip()],
+            "timeout": float(os.environ.get("DOWNLOAD_TIMEOUT", "300")),
+            "keep_hours": float(os.environ.get("DOWNLOAD_KEEP_HOURS", "24")),
+        }
     }
 
-def save_config(config):
-    """Save config - updates TOKEN and PREFIX in main.py"""
-    # Note: This doesn't actually modify the file, just updates in-memory config
-    # The token is stored directly in the TOKEN variable at the top of main.py
-    pass
+# ==================== STATE STORE ====================
+class StateStore:
+    """Persistent key/value state for runtime toggles (remote users, AFK, copycat, activity).
+    Reads come from memory; writes go to an append-only journal in debounced batches off the
+    event loop, and the journal is periodically compacted into an atomically replaced snapshot."""
+    def __init__(self, path, flush_delay=0.5, compact_every=200):
+        self.path = path
+        self.journal_path = path + ".journal"
+        self.flush_delay = flush_delay
+        self.compact_every = compact_every
+        self.data = {}
+        self.pending = []
+        self.journal_entries = 0
+        self.flush_handle = None
+        self.flush_lock = None
+        self.stats = {"writes": 0, "flushes": 0, "compactions": 0, "load_ms": 0.0}
+    
+    def load(self):
+        """Read the snapshot and replay the journal; runs once at startup before the loop exists"""
+        started = time.perf_counter()
+        try:
+            with open(self.path) as f:
+                self.data = json.load(f)
+        except (OSError, ValueError):
+            self.data = {}
+        if not isinstance(self.data, dict):
+            self.data = {}
+        try:
+            with open(self.journal_path, "rb+") as f:
+                good = 0
+                line = b"\n"
+                for line in f:
+                    try:
+                        key, value = json.loads(line)
+                        if value is None:
+                            self.data.pop(key, None)
+                        else:
+                            self.data[key] = value
+                    except (ValueError, TypeError):
+                        # A torn final line from a crash mid-append (or anything that is not a [key, value] pair):
+                        # drop it and what follows so new entries stay readable
+                        f.truncate(good)
+                        break
+                    good += len(line)
+                    self.journal_entries += 1
+                else:
+                    if not line.endswith(b"\n"):
+                        # A crash just before the newline left a complete entry; end it so the next append starts a fresh line
+                        f.seek(0, os.SEEK_END)
+                        f.write(b"\n")
+        except OSError:
+            pass
+        self.stats["load_ms"] = (time.perf_counter() - started) * 1000
+        return self.data
+    
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+    
+    def set(self, key, value):
+        """Update memory immediately and queue the change; None deletes the key"""
+        if value is None:
+            self.data.pop(key, None)
+        else:
+            self.data[key] = value
+        self.pending.append(json.dumps([key, value]))
+        self.stats["writes"] += 1
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+        self.flush_handle = loop.call_later(self.flush_delay, lambda: asyncio.ensure_future(self.flush()))
+    
+    def _append(self, lines, snapshot):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        if snapshot is not None:
+            temp_path = self.path + ".tmp"
+            with open(temp_path, "w") as f:
+                f.write(snapshot)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.path)
+            # The snapshot already contains every journaled change, start a fresh journal
+            mode = "w"
+        else:
+            mode = "a"
+        with open(self.journal_path, mode) as f:
+            if lines:
+                f.write("\n".join(lines) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+    
+    def _take_batch(self):
+        lines, self.pending = self.pending, []
+        self.journal_entries += len(lines)
+        snapshot = None
+        if self.journal_entries >= self.compact_every:
+            # Snapshot taken together with the batch, so it matches the journal exactly
+            snapshot = json.dumps(self.data)
+            lines = []
+            self.journal_entries = 0
+        return lines, snapshot
+    
+    async def flush(self):
+        self.flush_handle = None
+        if self.flush_lock is None:
+            self.flush_lock = asyncio.Lock()
+        async with self.flush_lock:
+            if not self.pending:
+                return
+            lines, snapshot = self._take_batch()
+            loop = asyncio.get_running_loop()
+            try:
+                await loop.run_in_executor(None, self._append, lines, snapshot)
+                self.stats["flushes"] += 1
+                if snapshot is not None:
+                    self.stats["compactions"] += 1
+            except OSError as e:
+                print(f"⚠️  Could not persist state: {e}")
+    
+    def close(self):
+        """Write anything still queued synchronously; used on shutdown"""
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if self.pending:
+            lines, snapshot = self._take_batch()
+            try:
+                self._append(lines, snapshot)
+            except OSError:
+                pass
 
 # ==================== UTILITIES ====================
+PING_PHASES = ("dns", "connect", "tls", "first_byte", "total")
+PING_MAX_URLS = 5
+PING_MAX_SAMPLES = 20
+PING_MAX_REDIRECTS = 5
+
+def normalize_url(url):
+    """Canonical form of a URL for cache keys: default scheme, lowercase host, sorted query, no fragment"""
+    if not url.startswith(("http://", "https://")):
+        url = "https://" + url
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    netloc = (parts.hostname or "").lower()
+    try:
+        port = parts.port
+    except ValueError:
+        # Out of range or non-numeric, e.g. example.com:99999
+        raise ValueError(f"Invalid URL: {url}") from None
+    if port and port != {"http": 80, "https": 443}.get(scheme):
+        netloc += f":{port}"
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, netloc, parts.path or "/", query, ""))
+
+def parse_viewport(value):
+    """Parse 'WIDTHxHEIGHT' into a (width, height) tuple"""
+    width, _, height = (value or "").lower().partition("x")
+    if not width.isdigit() or not height.isdigit():
+        raise ValueError(f"Invalid viewport: {value} (expected WIDTHxHEIGHT)")
+    return (min(max(int(width), 320), 3840), min(max(int(height), 240), 4320))
+
+def image_extension(data):
+    return "png" if data[:8] == b"\x89PNG\r\n\x1a\n" else "jpg"
+
+def fit_image(data, limit):
+    """Re-encode an image in memory until it fits under `limit` bytes"""
+    if len(data) <= limit or not load_pil():
+        return data
+    image = Image.open(io.BytesIO(data)).convert("RGB")
+    encoded = data
+    for scale in (1, 0.75, 0.5, 0.35, 0.25):
+        frame = image if scale == 1 else image.resize((max(1, int(image.width * scale)), max(1, int(image.height * scale))), Image.LANCZOS)
+        for quality in (85, 70, 50):
+            buffer = io.BytesIO()
+            frame.save(buffer, format="JPEG", quality=quality, optimize=True)
+            encoded = buffer.getvalue()
+            if len(encoded) <= limit:
+                return encoded
+    return encoded
+
 def get_uptime(start_time):
     uptime_seconds = time.time() - start_time
     days = int(uptime_seconds // 86400)
@@ -163,129 +558,2228 @@ def get_uptime(start_time):
     else:
         return f"{seconds}s"
 
-def ping_website(url):
-    try:
-        if not url.startswith(("http://", "https://")):
-            url = "https://" + url
-        start_time = time.time()
-        response = requests.get(url, timeout=10, allow_redirects=True)
-        elapsed_time = (time.time() - start_time) * 1000
-        return {"status_code": response.status_code, "response_time": f"{elapsed_time:.2f}ms", "online": response.status_code == 200}
-    except Exception as e:
-        return {"status_code": None, "response_time": None, "online": False, "error": str(e)}
-
-def geoip_lookup(ip):
-    try:
-        response = requests.get(f"http://ip-api.com/json/{ip}", timeout=10)
-        data = response.json()
-        if data.get("status") == "success":
-            return {"country": data.get("country"), "region": data.get("regionName"), "city": data.get("city"), "isp": data.get("isp"), "timezone": data.get("timezone")}
-        else:
-            return {"error": "Failed to lookup IP"}
-    except Exception as e:
-        return {"error": str(e)}
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[min(int(rank), len(ordered)) - 1]
+
+async def probe_url(url, timeout=10):
+    """Time one HTTP request, split into DNS, connect, TLS and first-byte phases (ms).
+    This deliberately bypasses the shared HTTPClient session: aiohttp pools connections and reports
+    TCP and TLS as one phase, so the handshake is driven step by step on a fresh raw socket."""
+    parsed = urlsplit(url)
+    host = parsed.hostname
+    https = parsed.scheme == "https"
+    default_port = 443 if https else 80
+    port = parsed.port or default_port
+    path = (parsed.path or "/") + (f"?{parsed.query}" if parsed.query else "")
+    host_header = f"[{host}]" if ":" in host else host
+    if port != default_port:
+        host_header += f":{port}"
+    loop = asyncio.get_running_loop()
+    writer = None
+
+    async def run():
+        nonlocal writer
+        start = time.perf_counter()
+        infos = await loop.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        dns_done = time.perf_counter()
+        # Try every resolved address in order, like a browser falling back from a dead IPv6 route
+        sock, error = None, OSError(f"No addresses for {host}")
+        for family, _, _, _, addr in infos:
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            sock.setblocking(False)
+            try:
+                await loop.sock_connect(sock, addr)
+                break
+            except OSError as e:
+                sock.close()
+                sock, error = None, e
+            except BaseException:
+                sock.close()
+                raise
+        if sock is None:
+            raise error
+        connect_done = time.perf_counter()
+        if https:
+            reader, writer = await asyncio.open_connection(sock=sock, ssl=ssl.create_default_context(), server_hostname=host)
+            tls_done = time.perf_counter()
+        else:
+            reader, writer = await asyncio.open_connection(sock=sock)
+            tls_done = connect_done
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: {host_header}\r\nUser-Agent: Mozilla/5.0\r\nAccept: */*\r\nConnection: close\r\n\r\n".encode())
+        await writer.drain()
+        status_line = await reader.readline()
+        first_byte = time.perf_counter()
+        parts = status_line.split()
+        if len(parts) < 2 or not parts[1].isdigit():
+            raise ValueError("Invalid HTTP response")
+        status_code = int(parts[1])
+        location = None
+        if 300 <= status_code < 400:
+            while True:
+                line = await reader.readline()
+                if not line.strip():
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                if name.strip().lower() == "location":
+                    location = urljoin(url, value.strip())
+        return {
+            "status_code": status_code,
+            "location": location,
+            "dns": (dns_done - start) * 1000,
+            "connect": (connect_done - dns_done) * 1000,
+            "tls": (tls_done - connect_done) * 1000,
+            "first_byte": (first_byte - tls_done) * 1000,
+            "total": (first_byte - start) * 1000,
+        }
+
+    try:
+        return await asyncio.wait_for(run(), timeout)
+    finally:
+        if writer:
+            writer.close()
+
+async def ping_website(url, samples=1, timeout=10):
+    """Probe a URL `samples` times and summarise min/p50/p95/max per phase"""
+    if not url.startswith(("http://", "https://")):
+        url = "https://" + url
+    timings = []
+    status_code = None
+    error = None
+    target = url
+    redirects = 0
+    for _ in range(samples):
+        try:
+            result = await probe_url(target, timeout)
+            # Redirects are followed once; later samples go straight to where the chain ended
+            while result["location"] and redirects < PING_MAX_REDIRECTS:
+                target = result["location"]
+                redirects += 1
+                result = await probe_url(target, timeout)
+            if result["location"]:
+                error = f"Too many redirects (more than {PING_MAX_REDIRECTS})"
+                break
+            status_code = result.pop("status_code")
+            del result["location"]
+            timings.append(result)
+        except asyncio.TimeoutError:
+            error = f"Timed out after {timeout}s"
+        except Exception as e:
+            error = str(e) or type(e).__name__
+    if not timings:
+        return {"url": url, "final_url": target, "status_code": None, "online": False, "samples": 0, "error": error}
+    stats = {}
+    for phase in PING_PHASES:
+        values = [t[phase] for t in timings]
+        stats[phase] = {"min": min(values), "p50": percentile(values, 50), "p95": percentile(values, 95), "max": max(values)}
+    return {"url": url, "final_url": target, "status_code": status_code, "online": status_code < 400, "samples": len(timings), "stats": stats, "error": error}
+
+async def ping_websites(urls, samples=1, timeout=10):
+    """Probe several URLs concurrently"""
+    return await asyncio.gather(*(ping_website(url, samples, timeout) for url in urls))
+
+def reverse_text(text):
+    return text[::-1]
+
+def generate_fake_token():
+    user_id = ''.join(random.choices(string.ascii_letters + string.digits, k=18))
+    timestamp = ''.join(random.choices(string.ascii_letters + string.digits, k=10))
+    hmac = ''.join(random.choices(string.ascii_letters + string.digits, k=27))
+    return f"{user_id}.{timestamp}.{hmac}"
+
+# ==================== TEXT TRANSFORMS ====================
+MESSAGE_LIMIT = 2000
+TRANSFORM_MAX_CHUNKS = 10
+
+def ascii_text(text):
+    return "\n".join(text.upper())
+
+def hide_mentions(text):
+    return text.replace("@", "@\u200b")
+
+# Keep translate tables ASCII -> ASCII: anything else drops str.translate off its fast path
+LEET_TABLE = str.maketrans("aeiostlgAEIOSTLG", "4310571943105719")
+
+def leet_text(text):
+    return text.translate(LEET_TABLE)
+
+TEXT_TRANSFORMS = {
+    "leet": leet_text,
+    "reverse": reverse_text,
+    "hidemention": hide_mentions,
+    "ascii": ascii_text,
+}
+
+def compile_transforms(spec):
+    """Turn "leet|reverse|hidemention" into the list of str -> str steps to apply in order.
+    hidemention always runs last, since an earlier place would let e.g. reverse rebuild a live mention."""
+    steps = []
+    for name in spec.lower().split("|"):
+        transform = TEXT_TRANSFORMS.get(name.strip())
+        if transform is None:
+            raise ValueError(f"Unknown transform `{name.strip()}` (available: {', '.join(TEXT_TRANSFORMS)})")
+        steps.append(transform)
+    if hide_mentions in steps:
+        steps = [step for step in steps if step is not hide_mentions] + [hide_mentions]
+    return steps
+
+def apply_transforms(steps, text):
+    for step in steps:
+        text = step(text)
+    return text
+
+def split_message(text, limit=MESSAGE_LIMIT):
+    """Split text into chunks of at most `limit` characters, breaking at a newline or space when possible"""
+    chunks = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit + 1)
+        if cut <= 0:
+            cut = text.rfind(" ", 0, limit + 1)
+        if cut <= 0:
+            chunks.append(text[:limit])
+            text = text[limit:]
+        else:
+            chunks.append(text[:cut])
+            text = text[cut + 1:]
+    chunks.append(text)
+    return chunks
+
+def pack_blocks(blocks, limit=MESSAGE_LIMIT):
+    """Join blocks with newlines into chunks of at most `limit` characters without splitting a block.
+    Keeps code fences intact; a single block over the limit is split on its own."""
+    chunks = []
+    current = ""
+    for block in blocks:
+        if current and len(current) + 1 + len(block) <= limit:
+            current += "\n" + block
+            continue
+        if current:
+            chunks.append(current)
+        current = block
+        if len(current) > limit:
+            *full, current = split_message(current, limit)
+            chunks.extend(full)
+    if current:
+        chunks.append(current)
+    return chunks
+
+# ==================== MINESWEEPER ====================
+MINESWEEPER_MAX_SIDE = 15
+MINESWEEPER_DENSITY = 0.15
+MINESWEEPER_BOMB = 9
+# Index 0-8 is the neighbour count, MINESWEEPER_BOMB is a mine
+MINESWEEPER_CELLS = tuple(f"||:{name}:||" for name in ("zero", "one", "two", "three", "four", "five", "six", "seven", "eight", "bomb"))
+MINESWEEPER_CELL_MAX = max(len(cell) for cell in MINESWEEPER_CELLS)
+MINESWEEPER_NEIGHBORS = {}
+
+def minesweeper_neighbors(width, height):
+    """Offset table of in-bounds neighbour indices for every cell, built once per board size"""
+    table = MINESWEEPER_NEIGHBORS.get((width, height))
+    if table is None:
+        offsets = [(dx, dy) for dy in (-1, 0, 1) for dx in (-1, 0, 1) if dx or dy]
+        table = tuple(
+            tuple((y + dy) * width + x + dx for dx, dy in offsets if 0 <= x + dx < width and 0 <= y + dy < height)
+            for y in range(height) for x in range(width)
+        )
+        MINESWEEPER_NEIGHBORS[(width, height)] = table
+    return table
+
+def fit_minesweeper(width, height, reserve=0):
+    """Clamp a board so that even the worst case (every cell the longest emoji) plus
+    `reserve` characters of header fits in one 2000 character message"""
+    width = min(max(width, 2), MINESWEEPER_MAX_SIDE)
+    height = min(max(height, 2), MINESWEEPER_MAX_SIDE)
+    max_rows = (2000 - reserve + 1) // (width * MINESWEEPER_CELL_MAX + 1)
+    return width, min(height, max_rows)
+
+def generate_minesweeper(width, height, mines, seed=None):
+    """Spoiler-tagged board text; the same seed always yields the same board"""
+    cells = width * height
+    mines = min(max(mines, 1), cells - 1)
+    placed = random.Random(seed).sample(range(cells), mines)
+    neighbors = minesweeper_neighbors(width, height)
+    counts = [0] * cells
+    for index in placed:
+        for neighbor in neighbors[index]:
+            counts[neighbor] += 1
+    for index in placed:
+        counts[index] = MINESWEEPER_BOMB
+    lookup = MINESWEEPER_CELLS.__getitem__
+    return "\n".join("".join(map(lookup, counts[start:start + width])) for start in range(0, cells, width))
+
+# ==================== HTTP CLIENT ====================
+class HTTPClient:
+    """Process-wide pooled aiohttp session: keep-alive, DNS cache and per-host limits"""
+    def __init__(self, config, trace_configs=None):
+        self.config = config.get("http", {})
+        self.trace_configs = trace_configs
+        self._session = None
+    
+    @property
+    def session(self):
+        """Shared session, created on first use inside the running loop"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.config.get("limit", 100),
+                limit_per_host=self.config.get("limit_per_host", 10),
+                ttl_dns_cache=self.config.get("dns_ttl", 300),
+                keepalive_timeout=self.config.get("keepalive", 30),
+            )
+            timeout = aiohttp.ClientTimeout(total=self.config.get("timeout", 30), connect=self.config.get("connect_timeout", 10))
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout, trace_configs=self.trace_configs)
+        return self._session
+    
+    def request(self, method, url, **kwargs):
+        return self.session.request(method, url, **kwargs)
+    
+    def get(self, url, **kwargs):
+        return self.session.get(url, **kwargs)
+    
+    def post(self, url, **kwargs):
+        return self.session.post(url, **kwargs)
+    
+    async def close(self):
+        if self._session and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+# ==================== MEMORY STATS ====================
+MEMSTATS_SAMPLE = 32
+
+def shallow_object_size(obj):
+    """Size of an object plus its direct attribute values (slots or __dict__)"""
+    size = sys.getsizeof(obj)
+    values = []
+    for cls in type(obj).__mro__:
+        for slot in getattr(cls, "__slots__", ()):
+            value = getattr(obj, slot, None)
+            if value is not None:
+                values.append(value)
+    if hasattr(obj, "__dict__"):
+        size += sys.getsizeof(obj.__dict__)
+        values.extend(obj.__dict__.values())
+    for value in values:
+        if isinstance(value, (str, bytes, int, float, tuple, list, dict, set, frozenset)):
+            size += sys.getsizeof(value)
+    return size
+
+def estimate_cache_bytes(objects):
+    """Approximate bytes held by a cache from the average size of a small sample"""
+    objects = list(objects)
+    if not objects:
+        return 0
+    sample = random.sample(objects, min(MEMSTATS_SAMPLE, len(objects)))
+    return int(sum(shallow_object_size(obj) for obj in sample) / len(sample) * len(objects))
+
+def collect_cache_objects(client):
+    """Snapshot the client's in-memory caches as lists (run on the loop so nothing mutates mid-walk)"""
+    state = client._connection
+    guilds = list(state._guilds.values()) if hasattr(state, "_guilds") else []
+    members = [member for guild in guilds for member in guild._members.values()]
+    presences = list(getattr(state, "_presences", {}).values())
+    for guild_presences in getattr(state, "_guild_presences", {}).values():
+        presences.extend(guild_presences.values())
+    caches = {
+        "messages": list(state._messages or []),
+        "members": members,
+        "users": list(state._users.values()),
+        "presences": presences,
+        "guilds": guilds,
+        "channels": [channel for guild in guilds for channel in guild._channels.values()],
+    }
+    return caches
+
+def estimate_caches(caches):
+    """Entry counts and approximate bytes for each cache snapshot"""
+    return {name: (len(objects), estimate_cache_bytes(objects)) for name, objects in caches.items()}
+
+def process_rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        try:
+            import resource
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+        except ImportError:
+            return None
+
+# ==================== GEOIP ====================
+GEOIP_BATCH_SIZE = 100
+
+class IpApiBackend:
+    """ip-api.com JSON API, or any stand-in server speaking the same protocol"""
+    def __init__(self, http, base_url="http://ip-api.com", timeout=10):
+        self.http = http
+        self.base_url = base_url.rstrip("/")
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+    
+    def _parse(self, data):
+        if data.get("status") == "success":
+            return {"country": data.get("country"), "region": data.get("regionName"), "city": data.get("city"), "isp": data.get("isp"), "timezone": data.get("timezone")}
+        return {"error": data.get("message") or "Failed to lookup IP"}
+    
+    async def lookup_many(self, ips):
+        if len(ips) == 1:
+            async with self.http.get(f"{self.base_url}/json/{ips[0]}", timeout=self.timeout) as response:
+                return {ips[0]: self._parse(await response.json(content_type=None))}
+        results = {}
+        for i in range(0, len(ips), GEOIP_BATCH_SIZE):
+            chunk = ips[i:i + GEOIP_BATCH_SIZE]
+            async with self.http.post(f"{self.base_url}/batch", json=[{"query": ip} for ip in chunk], timeout=self.timeout) as response:
+                for ip, data in zip(chunk, await response.json(content_type=None)):
+                    # ip-api echoes the resolved address in "query", so a hostname would never match its key
+                    results[ip] = self._parse(data)
+        return results
+    
+    async def close(self):
+        pass
+
+class MMDBBackend:
+    """Local MaxMind database file (GeoLite2-City or compatible), read off the event loop"""
+    def __init__(self, path):
+        import maxminddb
+        self.reader = maxminddb.open_database(path)
+    
+    def _lookup(self, ip):
+        try:
+            record = self.reader.get(ip)
+        except ValueError as e:
+            return {"error": str(e)}
+        if not record:
+            return {"error": "Failed to lookup IP"}
+        name = lambda entry: (entry or {}).get("names", {}).get("en")
+        subdivisions = record.get("subdivisions") or [{}]
+        return {"country": name(record.get("country")), "region": name(subdivisions[0]), "city": name(record.get("city")), "isp": (record.get("traits") or {}).get("isp"), "timezone": (record.get("location") or {}).get("time_zone")}
+    
+    async def lookup_many(self, ips):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, lambda: {ip: self._lookup(ip) for ip in ips})
+    
+    async def close(self):
+        self.reader.close()
+
+def make_geoip_backend(config, http):
+    geoip_config = config.get("geoip", {})
+    if geoip_config.get("backend") == "mmdb" and geoip_config.get("mmdb_path"):
+        return MMDBBackend(geoip_config["mmdb_path"])
+    return IpApiBackend(http, geoip_config.get("api_url", "http://ip-api.com"))
+
+class GeoIPCache:
+    """In-memory TTL/LRU cache in front of an on-disk SQLite store and a lookup backend"""
+    def __init__(self, backend, db_path=None, ttl=86400, max_entries=1024):
+        self.backend = backend
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.memory = OrderedDict()
+        self.db = None
+        self.db_path = db_path
+        self.hits = {"memory": 0, "disk": 0, "backend": 0}
+    
+    def _open_db(self):
+        if self.db is None and self.db_path:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            self.db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS geoip (ip TEXT PRIMARY KEY, data TEXT NOT NULL, expires REAL NOT NULL)")
+        return self.db
+    
+    def _load(self, ips):
+        db = self._open_db()
+        if not db:
+            return {}
+        rows = db.execute(f"SELECT ip, data, expires FROM geoip WHERE ip IN ({','.join('?' * len(ips))}) AND expires > ?", (*ips, time.time())).fetchall()
+        return {ip: (expires, json.loads(data)) for ip, data, expires in rows}
+    
+    def _store(self, entries):
+        db = self._open_db()
+        if not db:
+            return
+        with db:
+            db.executemany("INSERT OR REPLACE INTO geoip (ip, data, expires) VALUES (?, ?, ?)", [(ip, json.dumps(data), expires) for ip, (expires, data) in entries.items()])
+            db.execute("DELETE FROM geoip WHERE expires <= ?", (time.time(),))
+    
+    def _remember(self, ip, entry):
+        self.memory[ip] = entry
+        self.memory.move_to_end(ip)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+    
+    async def lookup(self, ips):
+        """Resolve IPs, returning {ip: result} in input order; misses are fetched from the backend in one batch"""
+        now = time.time()
+        order = list(dict.fromkeys(ips))
+        results = {}
+        misses = []
+        for ip in order:
+            entry = self.memory.get(ip)
+            if entry and entry[0] > now:
+                self.memory.move_to_end(ip)
+                results[ip] = entry[1]
+                self.hits["memory"] += 1
+            else:
+                self.memory.pop(ip, None)
+                misses.append(ip)
+        if not misses:
+            return {ip: results[ip] for ip in order}
+        loop = asyncio.get_running_loop()
+        try:
+            stored = await loop.run_in_executor(None, self._load, misses)
+        except sqlite3.Error:
+            stored = {}
+        for ip, entry in stored.items():
+            self._remember(ip, entry)
+            results[ip] = entry[1]
+            self.hits["disk"] += 1
+        misses = [ip for ip in misses if ip not in stored]
+        if not misses:
+            return {ip: results[ip] for ip in order}
+        try:
+            fetched = await self.backend.lookup_many(misses)
+        except Exception as e:
+            fetched = {ip: {"error": str(e) or type(e).__name__} for ip in misses}
+        fresh = {}
+        for ip in misses:
+            result = fetched.get(ip, {"error": "Failed to lookup IP"})
+            results[ip] = result
+            if "error" not in result:
+                fresh[ip] = (now + self.ttl, result)
+                self._remember(ip, fresh[ip])
+                self.hits["backend"] += 1
+        if fresh:
+            try:
+                await loop.run_in_executor(None, self._store, fresh)
+            except sqlite3.Error:
+                pass
+        return {ip: results[ip] for ip in order}
+    
+    async def close(self):
+        try:
+            await self.backend.close()
+        except Exception:
+            pass
+        if self.db:
+            self.db.close()
+            self.db = None
+
+# ==================== CAPTURE CACHE ====================
+class CaptureCache:
+    """Size-capped LRU cache of rendered captures in SQLite, keyed by URL and capture options"""
+    def __init__(self, db_path, ttl=3600, max_bytes=200 * 1024 * 1024):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.db = None
+        self.lock = threading.Lock()
+        self.total_bytes = 0
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+    
+    @staticmethod
+    def make_key(kind, url, **options):
+        raw = json.dumps([kind, normalize_url(url), sorted(options.items())], default=str)
+        return hashlib.sha1(raw.encode()).hexdigest()
+    
+    def _open_db(self):
+        if self.db is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            self.db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS captures (key TEXT PRIMARY KEY, data BLOB NOT NULL, size INTEGER NOT NULL, expires REAL NOT NULL, accessed REAL NOT NULL)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS captures_accessed ON captures (accessed)")
+            self.total_bytes = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM captures").fetchone()[0]
+        return self.db
+    
+    def _get(self, key):
+        with self.lock:
+            db = self._open_db()
+            row = db.execute("SELECT data, size, expires FROM captures WHERE key = ?", (key,)).fetchone()
+            if not row:
+                return None
+            data, size, expires = row
+            with db:
+                if expires <= time.time():
+                    db.execute("DELETE FROM captures WHERE key = ?", (key,))
+                    self.total_bytes -= size
+                    return None
+                db.execute("UPDATE captures SET accessed = ? WHERE key = ?", (time.time(), key))
+            return data
+    
+    def _put(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        with self.lock:
+            db = self._open_db()
+            now = time.time()
+            with db:
+                old = db.execute("SELECT size FROM captures WHERE key = ?", (key,)).fetchone()
+                if old:
+                    self.total_bytes -= old[0]
+                db.execute("INSERT OR REPLACE INTO captures (key, data, size, expires, accessed) VALUES (?, ?, ?, ?, ?)", (key, data, len(data), now + self.ttl, now))
+                self.total_bytes += len(data)
+                for expired_key, size in db.execute("SELECT key, size FROM captures WHERE expires <= ?", (now,)).fetchall():
+                    db.execute("DELETE FROM captures WHERE key = ?", (expired_key,))
+                    self.total_bytes -= size
+                while self.total_bytes > self.max_bytes:
+                    victim = db.execute("SELECT key, size FROM captures ORDER BY accessed LIMIT 1").fetchone()
+                    if not victim:
+                        break
+                    db.execute("DELETE FROM captures WHERE key = ?", (victim[0],))
+                    self.total_bytes -= victim[1]
+                    self.stats["evictions"] += 1
+    
+    def _clear(self):
+        with self.lock:
+            db = self._open_db()
+            with db:
+                db.execute("DELETE FROM captures")
+            self.total_bytes = 0
+    
+    async def get(self, key):
+        loop = asyncio.get_running_loop()
+        try:
+            data = await loop.run_in_executor(None, self._get, key)
+        except sqlite3.Error:
+            data = None
+        self.stats["hits" if data is not None else "misses"] += 1
+        return data
+    
+    async def put(self, key, data):
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, self._put, key, data)
+            self.stats["stores"] += 1
+        except sqlite3.Error:
+            pass
+    
+    async def clear(self):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._clear)
+    
+    def close(self):
+        with self.lock:
+            if self.db:
+                self.db.close()
+                self.db = None
+
+# ==================== QR CODES ====================
+QR_FORMATS = ("png", "small", "svg")
+QR_ERROR_LEVELS = "LMQH"
+QR_MAX_BOX_SIZE = 40
+QR_BATCH_MAX = 16
+
+def build_qr(text, error_correction="M", box_size=10, border=4):
+    qr = qrcode.QRCode(error_correction=getattr(qrcode.constants, f"ERROR_CORRECT_{error_correction}"), box_size=box_size, border=border)
+    qr.add_data(text)
+    qr.make(fit=True)
+    return qr
+
+def render_qr_image(text, error_correction="M", box_size=10):
+    """Render the module matrix straight into a 1-bit image, one resize instead of per-box drawing"""
+    matrix = build_qr(text, error_correction).get_matrix()
+    modules = len(matrix)
+    img = Image.new("1", (modules, modules), 1)
+    img.putdata([0 if cell else 1 for row in matrix for cell in row])
+    return img.resize((modules * box_size, modules * box_size), Image.NEAREST)
+
+def generate_qr_code(text, error_correction="M", box_size=10, fmt="png"):
+    """Encode one QR code as PNG, palette-free 1-bit PNG ("small") or SVG bytes"""
+    if not load_qrcode():
+        return None
+    if fmt == "svg":
+        svg = importlib.import_module("qrcode.image.svg")
+        return build_qr(text, error_correction, box_size).make_image(image_factory=svg.SvgPathImage).to_string()
+    img = render_qr_image(text, error_correction, box_size)
+    img_bytes = io.BytesIO()
+    if fmt == "small":
+        img.save(img_bytes, format="PNG", optimize=True)
+    else:
+        img.convert("L").save(img_bytes, format="PNG")
+    return img_bytes.getvalue()
+
+def generate_qr_sheet(texts, error_correction="M", box_size=10, fmt="png"):
+    """Render several codes into one PNG grid, scaled to the largest code"""
+    if not load_qrcode():
+        return None
+    images = [render_qr_image(text, error_correction, box_size) for text in texts]
+    cell = max(img.size[0] for img in images)
+    columns = min(len(images), 4)
+    rows = (len(images) + columns - 1) // columns
+    gap = box_size * 2
+    sheet = Image.new("1", (columns * (cell + gap) + gap, rows * (cell + gap) + gap), 1)
+    for i, img in enumerate(images):
+        offset = (cell - img.size[0]) // 2
+        sheet.paste(img, (gap + (i % columns) * (cell + gap) + offset, gap + (i // columns) * (cell + gap) + offset))
+    img_bytes = io.BytesIO()
+    if fmt == "small":
+        sheet.save(img_bytes, format="PNG", optimize=True)
+    else:
+        sheet.convert("L").save(img_bytes, format="PNG")
+    return img_bytes.getvalue()
+
+class QRRenderer:
+    """Renders QR codes on a small worker pool with an LRU cache keyed by text and options.
+    Concurrent requests for the same code share a single render."""
+    def __init__(self, workers=2, cache_size=128):
+        self.workers = workers
+        self.cache_size = cache_size
+        self.executor = None
+        self.cache = OrderedDict()
+        self.inflight = {}
+        self.stats = {"hits": 0, "misses": 0, "render_ms": 0.0}
+    
+    async def _render(self, key, func, *args):
+        data = self.cache.get(key)
+        if data is not None:
+            self.cache.move_to_end(key)
+            self.stats["hits"] += 1
+            return data
+        if key in self.inflight:
+            self.stats["hits"] += 1
+            return await asyncio.shield(self.inflight[key])
+        self.stats["misses"] += 1
+        if self.executor is None:
+            self.executor = TimedThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="qr")
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        future = loop.run_in_executor(self.executor, func, *args)
+        self.inflight[key] = future
+        try:
+            data = await asyncio.shield(future)
+        finally:
+            self.inflight.pop(key, None)
+        self.stats["render_ms"] += (time.perf_counter() - started) * 1000
+        if data is not None:
+            self.cache[key] = data
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return data
+    
+    async def render(self, text, error_correction="M", box_size=10, fmt="png"):
+        return await self._render(("one", text, error_correction, box_size, fmt), generate_qr_code, text, error_correction, box_size, fmt)
+    
+    async def render_sheet(self, texts, error_correction="M", box_size=10, fmt="png"):
+        return await self._render(("sheet", tuple(texts), error_correction, box_size, fmt), generate_qr_sheet, texts, error_correction, box_size, fmt)
+    
+    def close(self):
+        if self.executor:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+# ==================== DOWNLOADER ====================
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+DOWNLOAD_FLUSH_SIZE = 1024 * 1024
+DOWNLOAD_RETRIES = 3
+
+def safe_filename(name):
+    name = re.sub(r"[^A-Za-z0-9._-]+", "_", os.path.basename(name or "")).strip("._")
+    return name[:100] or "download"
+
+def format_size(num_bytes):
+    for unit in ("B", "KB", "MB"):
+        if num_bytes < 1024:
+            return f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f} GB"
+
+class DownloadError(Exception):
+    """Raised when a download is rejected by the pre-checks or cannot be completed"""
+
+class Downloader:
+    """Streaming HTTP downloader: HEAD pre-checks, size guard, Range resume and segmented fetch"""
+    def __init__(self, http, config):
+        download_config = config.get("download", {})
+        self.http = http
+        self.directory = download_config.get("dir", "temp")
+        self.max_bytes = download_config.get("max_bytes", 100 * 1024 * 1024)
+        self.segments = max(1, download_config.get("segments", 4))
+        self.segment_threshold = download_config.get("segment_threshold", 8 * 1024 * 1024)
+        self.allowed_types = download_config.get("allowed_types", [])
+        self.keep_seconds = download_config.get("keep_hours", 24) * 3600
+        # The shared session's total timeout is sized for API calls, not file transfers
+        self.timeout = aiohttp.ClientTimeout(total=download_config.get("timeout", 300), sock_connect=10, sock_read=30)
+    
+    def _check(self, size, content_type):
+        if size is not None and size > self.max_bytes:
+            raise DownloadError(f"File too large ({format_size(size)} > {format_size(self.max_bytes)})")
+        if self.allowed_types and content_type and not any(content_type.lower().startswith(t) for t in self.allowed_types):
+            raise DownloadError(f"Content type not allowed: {content_type}")
+    
+    async def probe(self, url):
+        """HEAD the URL for size, MIME type and range support; empty if the server refuses HEAD"""
+        try:
+            async with self.http.request("HEAD", url, allow_redirects=True, timeout=self.timeout) as response:
+                if response.status >= 400:
+                    return {}
+                disposition = response.content_disposition
+                return {
+                    "url": str(response.url),
+                    "size": response.content_length,
+                    "type": response.content_type,
+                    "ranges": response.headers.get("Accept-Ranges", "").lower() == "bytes",
+                    "filename": disposition.filename if disposition else None,
+                }
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return {}
+    
+    def prune(self):
+        """Delete downloads older than `keep_seconds`: files too large to upload stay on disk for the user to fetch.
+        Only names this downloader writes (`<ms>_<name>` and their .part files) are touched, the directory may be shared."""
+        cutoff = time.time() - self.keep_seconds
+        try:
+            entries = list(os.scandir(self.directory))
+        except OSError:
+            return 0
+        removed = 0
+        for entry in entries:
+            prefix, _, _ = entry.name.partition("_")
+            try:
+                if prefix.isdigit() and entry.is_file() and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    removed += 1
+            except OSError:
+                pass
+        return removed
+    
+    async def download(self, url):
+        if not url.startswith(("http://", "https://")):
+            url = "https://" + url
+        info = await self.probe(url)
+        self._check(info.get("size"), info.get("type"))
+        url = info.get("url", url)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, lambda: (os.makedirs(self.directory, exist_ok=True), self.prune()))
+        path = os.path.join(self.directory, f"{int(time.time() * 1000)}_{safe_filename(info.get('filename') or urlsplit(url).path)}")
+        part = path + ".part"
+        size = info.get("size")
+        start = time.perf_counter()
+        try:
+            if size and info.get("ranges") and self.segments > 1 and size >= self.segment_threshold:
+                await self._fetch_segmented(url, part, size)
+                segments = self.segments
+            else:
+                size = await self._fetch_range(url, part, 0, None, check=not info)
+                segments = 1
+            await loop.run_in_executor(None, os.replace, part, path)
+        except (Exception, asyncio.CancelledError):
+            await loop.run_in_executor(None, lambda: os.path.exists(part) and os.remove(part))
+            raise
+        elapsed = max(time.perf_counter() - start, 1e-6)
+        return {"path": path, "bytes": size, "seconds": elapsed, "throughput": size / elapsed, "segments": segments}
+    
+    async def _fetch_segmented(self, url, part, size):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._preallocate, part, size)
+        step = -(-size // self.segments)
+        bounds = [(offset, min(offset + step, size) - 1) for offset in range(0, size, step)]
+        tasks = [asyncio.ensure_future(self._fetch_range(url, part, first, last)) for first, last in bounds]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            # gather leaves the other segments writing after the first failure; stop them before the part file goes
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+    
+    @staticmethod
+    def _preallocate(part, size):
+        with open(part, "wb") as f:
+            f.truncate(size)
+    
+    async def _fetch_range(self, url, part, first, last, check=False):
+        """Stream bytes first..last (or to EOF) into `part`, resuming with Range after dropped connections"""
+        loop = asyncio.get_running_loop()
+        mode = "r+b" if last is not None else "wb"
+        f = await loop.run_in_executor(None, open, part, mode)
+        written = 0
+        try:
+            for attempt in range(DOWNLOAD_RETRIES):
+                position = first + written
+                headers = {}
+                if last is not None:
+                    headers["Range"] = f"bytes={position}-{last}"
+                elif written:
+                    headers["Range"] = f"bytes={position}-"
+                buffer = bytearray()
+                try:
+                    async with self.http.get(url, headers=headers, timeout=self.timeout) as response:
+                        if response.status >= 400:
+                            raise DownloadError(f"HTTP {response.status}")
+                        if headers and response.status != 206:
+                            if last is not None:
+                                raise DownloadError("Server ignored the range request")
+                            # Resume not honoured, start again from the beginning
+                            written = 0
+                            await loop.run_in_executor(None, lambda: (f.seek(0), f.truncate()))
+                        if check:
+                            self._check(response.content_length, response.content_type)
+                        if last is not None:
+                            await loop.run_in_executor(None, f.seek, first + written)
+                        async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                            buffer += chunk
+                            if written + len(buffer) > self.max_bytes:
+                                raise DownloadError(f"File too large (> {format_size(self.max_bytes)})")
+                            if len(buffer) >= DOWNLOAD_FLUSH_SIZE:
+                                await loop.run_in_executor(None, f.write, bytes(buffer))
+                                written += len(buffer)
+                                buffer.clear()
+                    if last is not None and written + len(buffer) < last - first + 1:
+                        raise aiohttp.ClientPayloadError("Segment ended early")
+                    return written + len(buffer)
+                except (aiohttp.ClientPayloadError, aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                    if attempt == DOWNLOAD_RETRIES - 1:
+                        raise DownloadError(f"Connection lost: {e or type(e).__name__}")
+                finally:
+                    if buffer:
+                        await loop.run_in_executor(None, f.write, bytes(buffer))
+                        written += len(buffer)
+        finally:
+            await loop.run_in_executor(None, f.close)
+
+# ==================== HTTP SCRAPER ====================
+SCRAPE_MAX_BYTES = 2 * 1024 * 1024
+SCRAPE_MIN_TEXT = 200
+SCRAPE_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36"
+
+class HTTPScraper:
+    """Browserless scrape tier: stream the page over HTTP and parse it incrementally with lxml"""
+    def __init__(self, http, timeout=15):
+        self.http = http
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.compiled = {}
+    
+    def _select(self, root, selector):
+        compiled = self.compiled.get(selector)
+        if compiled is None:
+            compiled = self.compiled[selector] = CSSSelector(selector)
+        return compiled(root)
+    
+    async def scrape(self, url, selectors):
+        """Returns {"results", "needs_browser", "elapsed"}, or None when the page can't be fetched as HTML"""
+        if not load_html_parser():
+            return None
+        if not url.startswith(("http://", "https://")):
+            url = "https://" + url
+        start = time.perf_counter()
+        try:
+            async with self.http.get(url, headers={"User-Agent": SCRAPE_USER_AGENT}, timeout=self.timeout) as response:
+                if response.status >= 400 or "html" not in response.content_type:
+                    return None
+                parser = lxml.html.HTMLParser(encoding=response.charset)
+                received = 0
+                async for chunk in response.content.iter_chunked(64 * 1024):
+                    parser.feed(chunk)
+                    received += len(chunk)
+                    if received >= SCRAPE_MAX_BYTES:
+                        break
+            root = parser.close()
+        except (aiohttp.ClientError, asyncio.TimeoutError, LookupError, ValueError):
+            return None
+        if root is None:
+            return None
+        scripts = len(root.findall(".//script"))
+        noscript = " ".join(el.text_content() for el in root.iter("noscript")).lower()
+        for el in list(root.iter("script", "style", "noscript", "template")):
+            el.drop_tree()
+        results = {}
+        for key, selector in selectors.items():
+            try:
+                matches = self._select(root, selector)
+            except Exception:
+                matches = []
+            results[key] = " ".join(" ".join(matches[0].itertext()).split()) if matches else None
+        body = root.find("body")
+        body_text = " ".join(" ".join(body.itertext()).split()) if body is not None else ""
+        # Empty selectors, a <noscript> nag or a script-heavy page with no text all point at client-side rendering
+        needs_browser = not all(results.values()) or "javascript" in noscript or (scripts > 0 and len(body_text) < SCRAPE_MIN_TEXT)
+        return {"results": results, "needs_browser": needs_browser, "elapsed": time.perf_counter() - start}
+
+# ==================== SELENIUM SCRAPER ====================
+NETWORK_IDLE_TIME = 0.5
+FULL_PAGE_MAX_HEIGHT = 16384
+
+def parse_wait_strategy(value, max_delay=None):
+    """Parse 'ready', 'networkidle', 'selector:<css>' or a fixed delay ('delay:2' or '2').
+    Delays must be finite and non-negative, and are capped at `max_delay` seconds."""
+    value = (value or "ready").strip()
+    kind, _, arg = value.partition(":")
+    kind = kind.lower()
+    if kind in ("ready", "networkidle", "idle"):
+        return ("networkidle" if kind == "idle" else kind, None)
+    if kind == "selector" and arg:
+        return ("selector", arg)
+    try:
+        delay = float(arg or 0) if kind == "delay" else float(value)
+    except ValueError:
+        raise ValueError(f"Unknown wait strategy: {value}")
+    # NaN fails both comparisons, so test for the valid range rather than the invalid one
+    if not 0 <= delay < float("inf"):
+        raise ValueError(f"Invalid wait delay: {value}")
+    return ("delay", min(delay, max_delay) if max_delay is not None else delay)
+
+def drain_performance_log(driver):
+    try:
+        return driver.get_log("performance")
+    except:
+        return None
+
+def wait_network_idle(driver, deadline, idle_time=NETWORK_IDLE_TIME):
+    """Poll the DevTools performance log until no request has been in flight for idle_time"""
+    inflight = set()
+    idle_since = time.perf_counter()
+    while time.perf_counter() < deadline:
+        entries = drain_performance_log(driver)
+        if entries is None:
+            return
+        for entry in entries:
+            try:
+                event = json.loads(entry["message"])["message"]
+            except:
+                continue
+            method = event.get("method")
+            request_id = event.get("params", {}).get("requestId")
+            if method == "Network.requestWillBeSent":
+                inflight.add(request_id)
+            elif method in ("Network.loadingFinished", "Network.loadingFailed"):
+                inflight.discard(request_id)
+        now = time.perf_counter()
+        if inflight or entries:
+            idle_since = now
+        elif now - idle_since >= idle_time:
+            return
+        time.sleep(0.05)
+
+def wait_for_page(driver, strategy, timeout=15):
+    """Block until the page satisfies the wait strategy, returning seconds waited"""
+    kind, arg = strategy
+    start = time.perf_counter()
+    try:
+        if kind == "delay":
+            time.sleep(min(arg, timeout))
+        elif kind == "selector":
+            WebDriverWait(driver, timeout, poll_frequency=0.05).until(EC.presence_of_element_located((By.CSS_SELECTOR, arg)))
+        else:
+            WebDriverWait(driver, timeout, poll_frequency=0.05).until(lambda d: d.execute_script("return document.readyState") == "complete")
+            if kind == "networkidle":
+                wait_network_idle(driver, start + timeout)
+    except TimeoutException:
+        # Capture whatever has rendered by the deadline
+        pass
+    return time.perf_counter() - start
+
+class ScraperBusy(Exception):
+    """Raised when no browser becomes available within the wait queue limits"""
+
+class DriverPool:
+    """Pool of pre-warmed webdrivers whose blocking calls run in a thread executor"""
+    def __init__(self, create_driver, size=2, max_waiters=8):
+        self.create_driver = create_driver
+        self.size = max(1, size)
+        self.max_waiters = max_waiters
+        self.executor = TimedThreadPoolExecutor(max_workers=self.size, thread_name_prefix="selenium")
+        self.drivers = set()
+        self.idle = None
+        self.starting = 0
+        self.waiters = 0
+    
+    def _queue(self):
+        # Created lazily so it binds to the loop that is actually running
+        if self.idle is None:
+            self.idle = asyncio.Queue()
+        return self.idle
+    
+    async def _spawn(self):
+        loop = asyncio.get_running_loop()
+        self.starting += 1
+        try:
+            driver = await loop.run_in_executor(self.executor, self.create_driver)
+        finally:
+            self.starting -= 1
+        self.drivers.add(driver)
+        self._queue().put_nowait(driver)
+    
+    async def start(self):
+        """Warm the pool up to its full size, returning the number of live drivers"""
+        missing = self.size - len(self.drivers) - self.starting
+        if missing > 0:
+            await asyncio.gather(*(self._spawn() for _ in range(missing)), return_exceptions=True)
+        return len(self.drivers)
+    
+    async def acquire(self, timeout=None):
+        queue = self._queue()
+        if queue.empty() and len(self.drivers) + self.starting < self.size:
+            try:
+                await self._spawn()
+            except Exception:
+                if not self.drivers and not self.starting:
+                    raise
+        if queue.empty() and self.waiters >= self.max_waiters:
+            raise ScraperBusy(f"Browser queue full ({self.waiters} waiting)")
+        self.waiters += 1
+        try:
+            driver = await asyncio.wait_for(queue.get(), timeout)
+        except asyncio.TimeoutError:
+            raise ScraperBusy(f"No browser free after {timeout}s")
+        finally:
+            self.waiters -= 1
+        if driver is None:
+            raise ScraperBusy("Browser pool closed")
+        return driver
+    
+    def release(self, driver, broken=False):
+        if broken:
+            # Quitting from another thread also unblocks a job still stuck on this driver
+            self.drivers.discard(driver)
+            threading.Thread(target=self._quit, args=(driver,), daemon=True).start()
+        elif driver in self.drivers:
+            self._queue().put_nowait(driver)
+    
+    async def run(self, job, *args, timeout=60, queue_timeout=None):
+        """Run `job(driver, *args)` on a pooled driver without blocking the event loop"""
+        driver = await self.acquire(queue_timeout)
+        loop = asyncio.get_running_loop()
+        broken = False
+        try:
+            return await asyncio.wait_for(loop.run_in_executor(self.executor, job, driver, *args), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            # The executor thread may still be driving this browser; never hand it to another job
+            broken = True
+            raise
+        except Exception as e:
+            # A dead session or crashed browser fails every later call too; a page timeout leaves it usable
+            if WebDriverException is not None and isinstance(e, WebDriverException) and not isinstance(e, TimeoutException):
+                broken = True
+            raise
+        finally:
+            self.release(driver, broken)
+    
+    @staticmethod
+    def _quit(driver):
+        try:
+            driver.quit()
+        except:
+            pass
+    
+    async def close(self):
+        drivers, self.drivers, idle, self.idle = list(self.drivers), set(), self.idle, None
+        if idle is not None:
+            # Waiters are parked on the old queue; wake each one with a sentinel so acquire() fails instead of hanging
+            for _ in range(self.waiters):
+                idle.put_nowait(None)
+        if drivers:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, lambda: [self._quit(driver) for driver in drivers])
+
+class SeleniumScraper:
+    def __init__(self, config):
+        self.config = config
+        selenium_config = config.get("selenium", {})
+        self.headless = selenium_config.get("headless", True)
+        self.job_timeout = selenium_config.get("job_timeout", 60)
+        self.upload_limit = config.get("upload_limit", 10 * 1024 * 1024)
+        self.queue_timeout = selenium_config.get("queue_timeout", 30)
+        self.wait_timeout = selenium_config.get("wait_timeout", 15)
+        try:
+            self.wait_strategy = parse_wait_strategy(selenium_config.get("wait", "ready"), self.wait_timeout)
+        except ValueError as e:
+            print(f"⚠️  {e}, using 'ready'")
+            self.wait_strategy = ("ready", None)
+        try:
+            self.viewport = parse_viewport(selenium_config.get("viewport", "1280x800"))
+        except ValueError as e:
+            print(f"⚠️  {e}, using 1280x800")
+            self.viewport = (1280, 800)
+        self.driver_path = None
+        self.driver_path_lock = threading.Lock()
+        self.pool = DriverPool(self._create_driver, selenium_config.get("pool_size", 2), selenium_config.get("max_waiters", 8))
+    
+    def _create_driver(self):
+        if not load_selenium():
+            raise RuntimeError("Selenium not available")
+        chrome_options = Options()
+        if self.headless:
+            chrome_options.add_argument("--headless")
+        chrome_options.add_argument("--no-sandbox")
+        chrome_options.add_argument("--disable-dev-shm-usage")
+        chrome_options.add_argument("--disable-blink-features=AutomationControlled")
+        chrome_options.add_experimental_option("excludeSwitches", ["enable-automation", "enable-logging"])
+        chrome_options.add_argument("--log-level=3")
+        chrome_options.add_argument(f"--window-size={self.viewport[0]},{self.viewport[1]}")
+        # Return from get() at DOMContentLoaded; the wait strategy decides when the page is ready
+        chrome_options.page_load_strategy = "eager"
+        chrome_options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+        chrome_options.add_experimental_option("perfLoggingPrefs", {"enableNetwork": True, "enablePage": False})
+        with self.driver_path_lock:
+            if self.driver_path is None:
+                try:
+                    self.driver_path = ChromeDriverManager().install() if ChromeDriverManager else ""
+                except:
+                    self.driver_path = ""
+        if self.driver_path:
+            driver = webdriver.Chrome(service=Service(self.driver_path), options=chrome_options)
+        else:
+            driver = webdriver.Chrome(options=chrome_options)
+        driver.set_page_load_timeout(30)
+        return driver
+    
+    async def initialize_driver(self):
+        if not SELENIUM_AVAILABLE:
+            return False
+        return await self.pool.start() > 0
+    
+    async def cleanup(self):
+        await self.pool.close()
+    
+    async def _run(self, job, *args):
+        return await self.pool.run(job, *args, timeout=self.job_timeout, queue_timeout=self.queue_timeout)
+    
+    def _navigate(self, driver, url, wait, viewport=None):
+        # Drop log entries left by the previous job so network-idle only sees this page
+        drain_performance_log(driver)
+        # Pooled drivers keep whatever size the previous job left behind
+        driver.set_window_size(*(viewport or self.viewport))
+        driver.get(url)
+        return wait_for_page(driver, wait or self.wait_strategy, self.wait_timeout)
+    
+    def _capture_full_page(self, driver):
+        """Scroll through the page one viewport at a time and stitch the tiles with Pillow"""
+        total_height, viewport_width, viewport_height = driver.execute_script(
+            "return [Math.max(document.body.scrollHeight, document.documentElement.scrollHeight), window.innerWidth, window.innerHeight]")
+        total_height = min(total_height, FULL_PAGE_MAX_HEIGHT)
+        if total_height <= viewport_height or not load_pil():
+            return driver.get_screenshot_as_png()
+        tiles = []
+        for offset in range(0, total_height, viewport_height):
+            scrolled = driver.execute_script("window.scrollTo(0, arguments[0]); return window.scrollY;", offset)
+            tiles.append((scrolled, Image.open(io.BytesIO(driver.get_screenshot_as_png()))))
+        scale = tiles[0][1].width / viewport_width
+        canvas = Image.new("RGB", (tiles[0][1].width, int(total_height * scale)), "white")
+        for scrolled, tile in tiles:
+            canvas.paste(tile, (0, int(scrolled * scale)))
+        buffer = io.BytesIO()
+        canvas.save(buffer, format="PNG")
+        return buffer.getvalue()
+    
+    def _take_screenshot(self, driver, url, wait, viewport, full_page):
+        waited = self._navigate(driver, url, wait, viewport)
+        data = self._capture_full_page(driver) if full_page else driver.get_screenshot_as_png()
+        return {"data": fit_image(data, self.upload_limit), "waited": waited}
+    
+    def _scrape_website_content(self, driver, url, selectors, wait):
+        waited = self._navigate(driver, url, wait)
+        results = {}
+        for key, selector in selectors.items():
+            try:
+                element = WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.CSS_SELECTOR, selector)))
+                results[key] = element.text if element.text else element.get_attribute("innerHTML")
+            except:
+                results[key] = None
+        return {"results": results, "waited": waited}
+    
+    async def take_screenshot(self, url, wait=None, viewport=None, full_page=False):
+        try:
+            return await self._run(self._take_screenshot, url, wait, viewport, full_page)
+        except ScraperBusy:
+            raise
+        except Exception:
+            return None
+    
+    async def scrape_website_content(self, url, selectors, wait=None):
+        try:
+            return await self._run(self._scrape_website_content, url, selectors, wait)
+        except ScraperBusy:
+            raise
+        except Exception:
+            return {}
+
+# ==================== MESSAGE INDEX ====================
+MESSAGE_INDEX_FLUSH_SIZE = 200
+
+class MessageIndex:
+    """SQLite index of this account's own message IDs per channel, so cleanup can target exact IDs.
+    Live messages are buffered and written in batches; deleted IDs are tombstoned and dropped on compaction."""
+    def __init__(self, db_path, flush_interval=2.0):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.db = None
+        self.lock = threading.Lock()
+        self.pending = []
+        self.removed = []
+        self.flush_handle = None
+        self.stats = {"recorded": 0, "flushes": 0, "removed": 0, "compacted": 0}
+    
+    def _open_db(self):
+        if self.db is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            self.db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS own_messages (id INTEGER PRIMARY KEY, channel_id INTEGER NOT NULL, created REAL NOT NULL, deleted INTEGER NOT NULL DEFAULT 0)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS own_messages_channel ON own_messages (channel_id, deleted, created)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS backfill (channel_id INTEGER PRIMARY KEY, oldest INTEGER, newest INTEGER, complete INTEGER NOT NULL DEFAULT 0)")
+        return self.db
+    
+    def record(self, message):
+        """Queue one of our own messages; called from on_message, so it only appends"""
+        self.pending.append((message.id, message.channel.id, message.created_at.timestamp()))
+        self.stats["recorded"] += 1
+        if len(self.pending) >= MESSAGE_INDEX_FLUSH_SIZE:
+            self._schedule_flush(0)
+        elif self.flush_handle is None:
+            self._schedule_flush(self.flush_interval)
+    
+    def forget(self, message_ids):
+        """Tombstone IDs that were deleted, by us or anyone else"""
+        self.removed.extend(message_ids)
+        if self.flush_handle is None:
+            self._schedule_flush(self.flush_interval)
+    
+    def _schedule_flush(self, delay):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+        loop = asyncio.get_running_loop()
+        self.flush_handle = loop.call_later(delay, lambda: asyncio.ensure_future(self.flush()))
+    
+    def _write(self, rows, removed):
+        with self.lock:
+            db = self._open_db()
+            with db:
+                if rows:
+                    db.executemany("INSERT OR IGNORE INTO own_messages (id, channel_id, created) VALUES (?, ?, ?)", rows)
+                if removed:
+                    db.executemany("UPDATE own_messages SET deleted = 1 WHERE id = ?", [(message_id,) for message_id in removed])
+    
+    async def flush(self):
+        self.flush_handle = None
+        rows, self.pending = self.pending, []
+        removed, self.removed = self.removed, []
+        if not rows and not removed:
+            return
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, self._write, rows, removed)
+            self.stats["flushes"] += 1
+            self.stats["removed"] += len(removed)
+        except sqlite3.Error:
+            pass
+    
+    def _query(self, channel_id, limit, older_than=None, newer_than=None):
+        with self.lock:
+            db = self._open_db()
+            sql = "SELECT id FROM own_messages WHERE channel_id = ? AND deleted = 0"
+            params = [channel_id]
+            if older_than:
+                sql += " AND created <= ?"
+                params.append(older_than)
+            if newer_than:
+                sql += " AND created >= ?"
+                params.append(newer_than)
+            sql += " ORDER BY id DESC LIMIT ?"
+            params.append(limit)
+            return [row[0] for row in db.execute(sql, params)]
+    
+    async def message_ids(self, channel_id, limit, older_than=None, newer_than=None):
+        """Newest-first IDs of our live messages in a channel, after flushing anything buffered"""
+        await self.flush()
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(None, self._query, channel_id, limit, older_than, newer_than)
+        except sqlite3.Error:
+            return []
+    
+    def _get_backfill(self, channel_id):
+        with self.lock:
+            row = self._open_db().execute("SELECT oldest, newest, complete FROM backfill WHERE channel_id = ?", (channel_id,)).fetchone()
+            return {"oldest": row[0], "newest": row[1], "complete": bool(row[2])} if row else {"oldest": None, "newest": None, "complete": False}
+    
+    def _set_backfill(self, channel_id, state):
+        with self.lock:
+            db = self._open_db()
+            with db:
+                db.execute("INSERT OR REPLACE INTO backfill (channel_id, oldest, newest, complete) VALUES (?, ?, ?, ?)", (channel_id, state["oldest"], state["newest"], int(state["complete"])))
+    
+    async def backfill(self, channel, self_id, limit=1000):
+        """Index our messages from channel history, continuing where the last run stopped.
+        New messages since the last run are caught up first, then older history is walked back."""
+        loop = asyncio.get_running_loop()
+        state = await loop.run_in_executor(None, self._get_backfill, channel.id)
+        scanned = found = 0
+        
+        async def walk(**kwargs):
+            nonlocal scanned, found
+            async for msg in channel.history(limit=limit - scanned, **kwargs):
+                scanned += 1
+                if msg.author.id == self_id:
+                    self.record(msg)
+                    found += 1
+                yield msg
+        
+        if state["newest"]:
+            # Catch up on anything sent while we were not connected
+            async for msg in walk(after=discord.Object(id=state["newest"]), oldest_first=True):
+                state["newest"] = msg.id
+                if scanned % 100 == 0:
+                    await self.flush()
+                    await loop.run_in_executor(None, self._set_backfill, channel.id, state)
+        if not state["complete"] and scanned < limit:
+            before = discord.Object(id=state["oldest"]) if state["oldest"] else None
+            exhausted = True
+            async for msg in walk(before=before):
+                state["oldest"] = msg.id
+                if state["newest"] is None:
+                    state["newest"] = msg.id
+                if scanned % 100 == 0:
+                    await self.flush()
+                    await loop.run_in_executor(None, self._set_backfill, channel.id, state)
+            if scanned >= limit:
+                exhausted = False
+            state["complete"] = exhausted
+        await self.flush()
+        await loop.run_in_executor(None, self._set_backfill, channel.id, state)
+        return {"scanned": scanned, "found": found, "complete": state["complete"]}
+    
+    def _compact(self):
+        with self.lock:
+            db = self._open_db()
+            with db:
+                dropped = db.execute("DELETE FROM own_messages WHERE deleted = 1").rowcount
+            db.execute("VACUUM")
+            return dropped
+    
+    async def compact(self):
+        """Physically drop tombstoned IDs and reclaim the file space"""
+        await self.flush()
+        loop = asyncio.get_running_loop()
+        dropped = await loop.run_in_executor(None, self._compact)
+        self.stats["compacted"] += dropped
+        return dropped
+    
+    def _summary(self):
+        with self.lock:
+            db = self._open_db()
+            live, tombstones = db.execute("SELECT COALESCE(SUM(deleted = 0), 0), COALESCE(SUM(deleted = 1), 0) FROM own_messages").fetchone()
+            channels, complete = db.execute("SELECT COUNT(*), COALESCE(SUM(complete), 0) FROM backfill").fetchone()
+            return {"live": live, "tombstones": tombstones, "channels": channels, "complete": complete}
+    
+    async def summary(self):
+        await self.flush()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._summary)
+    
+    def close(self):
+        with self.lock:
+            if self.db:
+                self.db.close()
+                self.db = None
+
+# ==================== DELETION ENGINE ====================
+DELETE_PROGRESS_INTERVAL = 3
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+ROUTE_MESSAGE_ID_RE = re.compile(r"(?<=/messages/)\d+")
+ROUTE_API_PREFIX_RE = re.compile(r"^/api/v\d+")
+
+def parse_duration(value):
+    """Parse '90s', '30m', '2h', '7d' or '1w' into seconds"""
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)([smhdw]?)", (value or "").strip().lower())
+    if not match:
+        raise ValueError(f"Invalid duration: {value} (use e.g. 30m, 2h, 7d)")
+    return float(match.group(1)) * DURATION_UNITS[match.group(2) or "s"]
+
+class RateLimitObserver:
+    """Tracks X-RateLimit-* headers seen on the client's own HTTP traffic through an aiohttp trace"""
+    def __init__(self):
+        self.routes = {}
+        self.trace = aiohttp.TraceConfig()
+        self.trace.on_request_end.append(self._on_request_end)
+    
+    @staticmethod
+    def route_key(method, path):
+        return f"{method.upper()} {ROUTE_MESSAGE_ID_RE.sub('{id}', ROUTE_API_PREFIX_RE.sub('', path))}"
+    
+    async def _on_request_end(self, session, context, params):
+        response = params.response
+        headers = response.headers
+        now = time.monotonic()
+        if response.status == 429:
+            try:
+                retry_after = float(headers.get("Retry-After", "1"))
+            except ValueError:
+                retry_after = 1.0
+            self.routes[self.route_key(params.method, params.url.path)] = {"remaining": 0, "reset_at": now + retry_after, "limited": True}
+        elif "X-RateLimit-Remaining" in headers:
+            try:
+                self.routes[self.route_key(params.method, params.url.path)] = {
+                    "remaining": int(headers["X-RateLimit-Remaining"]),
+                    "reset_at": now + float(headers.get("X-RateLimit-Reset-After", "0")),
+                    "limited": False,
+                }
+            except ValueError:
+                pass
+    
+    def delay_for(self, key):
+        """Seconds to wait so the remaining budget is spread over the time left until the bucket resets"""
+        state = self.routes.get(key)
+        if not state:
+            return 0
+        window = state["reset_at"] - time.monotonic()
+        if window <= 0:
+            return 0
+        if state["remaining"] <= 0:
+            return window
+        return window / (state["remaining"] + 1)
+
+class DeletionEngine:
+    """Streams channel history and deletes matching messages, paced by the observed rate-limit bucket.
+    Progress is checkpointed per channel so an interrupted run can be resumed."""
+    def __init__(self, bot, observer, config, index=None):
+        deletion_config = config.get("deletion", {})
+        self.bot = bot
+        self.observer = observer
+        self.index = index
+        self.state_path = deletion_config.get("state_path", os.path.join("data", "deletions.json"))
+        self.scan_factor = deletion_config.get("scan_factor", 20)
+        self.jobs = None
+    
+    def _load_jobs(self):
+        try:
+            with open(self.state_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+    
+    def _write_jobs(self, jobs):
+        os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+        temp_path = self.state_path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(jobs, f)
+        os.replace(temp_path, self.state_path)
+    
+    async def get_jobs(self):
+        if self.jobs is None:
+            loop = asyncio.get_running_loop()
+            self.jobs = await loop.run_in_executor(None, self._load_jobs)
+        return self.jobs
+    
+    async def _checkpoint(self):
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, self._write_jobs, dict(self.jobs))
+        except OSError:
+            pass
+    
+    @staticmethod
+    def matches(msg, filters):
+        if filters.get("author") is not None and msg.author.id != filters["author"]:
+            return False
+        if filters.get("contains") and filters["contains"] not in msg.content.lower():
+            return False
+        created = msg.created_at.timestamp()
+        if filters.get("older_than") and created > filters["older_than"]:
+            return False
+        return True
+    
+    async def _delete_indexed(self, channel, job, route, report):
+        """Delete our own messages by ID straight from the index; returns True if history still needs scanning"""
+        filters = job["filters"]
+        ids = await self.index.message_ids(channel.id, job["amount"] - job["deleted"], filters.get("older_than"), filters.get("newer_than"))
+        for message_id in ids:
+            delay = self.observer.delay_for(route)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                await channel.get_partial_message(message_id).delete()
+                job["deleted"] += 1
+                job["indexed"] = job.get("indexed", 0) + 1
+            except discord.NotFound:
+                pass
+            except discord.HTTPException:
+                continue
+            self.index.forget([message_id])
+            await report()
+        # Even a fully backfilled index misses messages sent from other clients while we were offline,
+        # so a short count always falls back to scanning history
+        return job["deleted"] < job["amount"]
+    
+    async def run(self, channel, amount, filters, progress=None, resume=False):
+        """Delete up to `amount` messages matching `filters`; returns counts and throughput"""
+        jobs = await self.get_jobs()
+        channel_key = str(channel.id)
+        job = jobs.get(channel_key) if resume else None
+        if job is None:
+            job = {"amount": amount, "filters": filters, "before": None, "deleted": 0, "scanned": 0, "indexed": 0}
+        jobs[channel_key] = job
+        amount, filters = job["amount"], job["filters"]
+        route = f"DELETE /channels/{channel.id}/messages/{{id}}"
+        scan_limit = max(amount * self.scan_factor, 500)
+        start = time.perf_counter()
+        deleted_before = job["deleted"]
+        last_report = start
+        finished = False
+        
+        async def report():
+            nonlocal last_report
+            now = time.perf_counter()
+            if progress and now - last_report >= DELETE_PROGRESS_INTERVAL:
+                last_report = now
+                await progress(job["deleted"], job["scanned"], now - start)
+        
+        try:
+            if self.index and self.bot.user and filters.get("author") == self.bot.user.id and not filters.get("contains"):
+                if not await self._delete_indexed(channel, job, route, report):
+                    finished = True
+                    return self._result(job, start, deleted_before)
+            before = discord.Object(id=job["before"]) if job["before"] else None
+            if before is None and filters.get("older_than"):
+                before = datetime.fromtimestamp(filters["older_than"], timezone.utc)
+            async for msg in channel.history(limit=scan_limit - job["scanned"], before=before):
+                if filters.get("newer_than") and msg.created_at.timestamp() < filters["newer_than"]:
+                    # History is newest-first, nothing older can match
+                    break
+                if self.matches(msg, filters):
+                    delay = self.observer.delay_for(route)
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    try:
+                        await msg.delete()
+                        job["deleted"] += 1
+                    except discord.NotFound:
+                        pass
+                    except discord.HTTPException:
+                        pass
+                # Only move the cursor once the message is handled, so a resume never skips it
+                job["scanned"] += 1
+                job["before"] = msg.id
+                if job["deleted"] >= amount:
+                    break
+                if job["scanned"] % 100 == 0:
+                    await self._checkpoint()
+                await report()
+            finished = True
+        finally:
+            if finished:
+                jobs.pop(channel_key, None)
+            await self._checkpoint()
+        return self._result(job, start, deleted_before)
+    
+    @staticmethod
+    def _result(job, start, deleted_before):
+        elapsed = max(time.perf_counter() - start, 1e-6)
+        return {"deleted": job["deleted"], "scanned": job["scanned"], "indexed": job.get("indexed", 0), "seconds": elapsed, "rate": (job["deleted"] - deleted_before) / elapsed}
+
+# ==================== LOOP MONITOR ====================
+CURRENT_COMMAND = contextvars.ContextVar("current_command", default=None)
+LAG_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+STALL_STACK_DEPTH = 12
+STALL_HISTORY = 50
+
+class LoopMonitor:
+    """Measures event-loop scheduling delay with a periodic sleeper and attributes stalls to commands.
+    A watchdog thread notices when the sleeper is overdue and snapshots the loop thread's stack and
+    the CURRENT_COMMAND of the task that is hogging it, read from that task's context."""
+    def __init__(self, interval=0.1, threshold_ms=100):
+        self.interval = interval
+        self.threshold = threshold_ms / 1000
+        self.loop = None
+        self.loop_thread_id = None
+        self.contexts = weakref.WeakKeyDictionary()
+        self.expected_wake = None
+        self.snapshot = None
+        self.stopped = threading.Event()
+        self.histogram = [0] * (len(LAG_BUCKETS_MS) + 1)
+        self.samples = 0
+        self.max_lag = 0.0
+        self.stalls = deque(maxlen=STALL_HISTORY)
+        self.by_command = {}
+        self.task = None
+    
+    def start(self):
+        if self.task is not None:
+            return
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+        self.task = self.loop.create_task(self._sample())
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+        if sys.version_info < (3, 11):
+            # Tasks only accept an explicit context from 3.11 on; stalls still get stacks, just no command name
+            return
+        previous_factory = self.loop.get_task_factory()
+        
+        def task_factory(loop, coro, **kwargs):
+            # Give each task its own Context object we can read later from the watchdog thread
+            context = kwargs.pop("context", None) or contextvars.copy_context()
+            if previous_factory:
+                task = previous_factory(loop, coro, context=context, **kwargs)
+            else:
+                task = asyncio.Task(coro, loop=loop, context=context, **kwargs)
+            self.contexts[task] = context
+            return task
+        
+        self.loop.set_task_factory(task_factory)
+    
+    def stop(self):
+        self.stopped.set()
+        if self.task:
+            self.task.cancel()
+            self.task = None
+    
+    async def _sample(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            self.expected_wake = expected
+            await asyncio.sleep(self.interval)
+            self._record(max(time.monotonic() - expected, 0.0), expected)
+    
+    def _watch(self):
+        captured = None
+        while not self.stopped.wait(self.threshold / 2):
+            expected = self.expected_wake
+            if expected is None or expected == captured or time.monotonic() - expected < self.threshold:
+                continue
+            captured = expected
+            frame = sys._current_frames().get(self.loop_thread_id)
+            task = getattr(asyncio.tasks, "_current_tasks", {}).get(self.loop)
+            context = self.contexts.get(task) if task is not None else None
+            self.snapshot = {
+                "expected": expected,
+                "command": context.get(CURRENT_COMMAND) if context is not None else None,
+                "task": task.get_name() if task is not None else None,
+                "stack": traceback.format_stack(frame, limit=STALL_STACK_DEPTH) if frame else [],
+            }
+    
+    def _record(self, lag, expected):
+        lag_ms = lag * 1000
+        self.histogram[bisect.bisect_left(LAG_BUCKETS_MS, lag_ms)] += 1
+        self.samples += 1
+        self.max_lag = max(self.max_lag, lag)
+        if lag < self.threshold:
+            return
+        snapshot = self.snapshot if self.snapshot and self.snapshot["expected"] == expected else {}
+        command = snapshot.get("command") or "(no command)"
+        stall = {"at": time.time(), "lag_ms": lag_ms, "command": command, "task": snapshot.get("task"), "stack": snapshot.get("stack", [])}
+        self.stalls.append(stall)
+        entry = self.by_command.setdefault(command, {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+        entry["count"] += 1
+        entry["total_ms"] += lag_ms
+        entry["max_ms"] = max(entry["max_ms"], lag_ms)
+        print(f"⚠️  Event loop stalled {lag_ms:.0f}ms during {command}")
+        if stall["stack"]:
+            print("".join(stall["stack"][-4:]).rstrip())
+    
+    def percentile_ms(self, pct):
+        """Upper bound of the histogram bucket holding the given percentile"""
+        if not self.samples:
+            return 0
+        target = self.samples * pct / 100
+        running = 0
+        for i, count in enumerate(self.histogram):
+            running += count
+            if running >= target:
+                return LAG_BUCKETS_MS[i] if i < len(LAG_BUCKETS_MS) else self.max_lag * 1000
+        return self.max_lag * 1000
+
+# ==================== METRICS ====================
+COMMAND_TIMINGS = contextvars.ContextVar("command_timings", default=None)
+METRIC_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+METRIC_PHASES = ("total", "rest", "blocking")
+
+class TimedThreadPoolExecutor(ThreadPoolExecutor):
+    """ThreadPoolExecutor that charges worker time to the command that submitted the job.
+    submit() runs on the loop in the caller's context, so the command's timings are visible there."""
+    def submit(self, fn, /, *args, **kwargs):
+        timings = COMMAND_TIMINGS.get()
+        if timings is None:
+            return super().submit(fn, *args, **kwargs)
+        
+        def timed():
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                # list.append is atomic, several workers may finish at once
+                timings["blocking"].append(time.perf_counter() - started)
+        return super().submit(timed)
+
+class Histogram:
+    """Fixed-bucket latency histogram in seconds, cumulative like Prometheus"""
+    def __init__(self, buckets=METRIC_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+    
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+    
+    def quantile(self, q):
+        """Linear interpolation inside the bucket that holds the quantile"""
+        if not self.count:
+            return 0.0
+        target = self.count * q
+        running = 0
+        lower = 0.0
+        for i, count in enumerate(self.counts):
+            if i == len(self.buckets):
+                # Beyond the last bound, report the bound like histogram_quantile() does
+                return lower
+            upper = self.buckets[i]
+            if count and running + count >= target:
+                return lower + (upper - lower) * (target - running) / count
+            running += count
+            lower = upper
+        return lower
+
+class CommandMetrics:
+    """Per-command call counts, error types and latency split into total, REST and worker-thread time"""
+    def __init__(self):
+        self.commands = {}
+        self.trace = aiohttp.TraceConfig()
+        self.attach(self.trace)
+        self.server = None
+    
+    def attach(self, trace):
+        """Time HTTP requests made through a session using this trace config"""
+        trace.on_request_start.append(self._on_request_start)
+        trace.on_request_end.append(self._on_request_finish)
+        trace.on_request_exception.append(self._on_request_finish)
+    
+    async def _on_request_start(self, session, context, params):
+        context.metrics_started = time.perf_counter()
+    
+    async def _on_request_finish(self, session, context, params):
+        timings = COMMAND_TIMINGS.get()
+        started = getattr(context, "metrics_started", None)
+        if timings is not None and started is not None:
+            timings["rest"] += time.perf_counter() - started
+    
+    def _entry(self, name):
+        entry = self.commands.get(name)
+        if entry is None:
+            entry = self.commands[name] = {"calls": 0, "errors": {}, "phases": {phase: Histogram() for phase in METRIC_PHASES}}
+        return entry
+    
+    def observe(self, name, total, timings, error=None):
+        entry = self._entry(name)
+        entry["calls"] += 1
+        phases = entry["phases"]
+        phases["total"].observe(total)
+        phases["rest"].observe(timings["rest"])
+        phases["blocking"].observe(sum(timings["blocking"]))
+        if error:
+            entry["errors"][error] = entry["errors"].get(error, 0) + 1
+    
+    def render_prometheus(self):
+        lines = [
+            "# HELP selfbot_command_calls_total Commands handled",
+            "# TYPE selfbot_command_calls_total counter",
+        ]
+        for name, entry in sorted(self.commands.items()):
+            lines.append(f'selfbot_command_calls_total{{command="{name}"}} {entry["calls"]}')
+        lines += ["# HELP selfbot_command_errors_total Commands that raised, by exception type", "# TYPE selfbot_command_errors_total counter"]
+        for name, entry in sorted(self.commands.items()):
+            for error, count in sorted(entry["errors"].items()):
+                lines.append(f'selfbot_command_errors_total{{command="{name}",type="{error}"}} {count}')
+        lines += ["# HELP selfbot_command_seconds Command latency by phase", "# TYPE selfbot_command_seconds histogram"]
+        for name, entry in sorted(self.commands.items()):
+            for phase, histogram in entry["phases"].items():
+                labels = f'command="{name}",phase="{phase}"'
+                running = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    running += count
+                    lines.append(f'selfbot_command_seconds_bucket{{{labels},le="{bound}"}} {running}')
+                lines.append(f'selfbot_command_seconds_bucket{{{labels},le="+Inf"}} {histogram.count}')
+                lines.append(f"selfbot_command_seconds_sum{{{labels}}} {histogram.sum:.6f}")
+                lines.append(f"selfbot_command_seconds_count{{{labels}}} {histogram.count}")
+        return "\n".join(lines) + "\n"
+    
+    async def start_server(self, host, port):
+        """Serve /metrics in Prometheus text format; meant for localhost scraping only"""
+        from aiohttp import web
+        
+        async def handle(request):
+            return web.Response(text=self.render_prometheus(), content_type="text/plain", charset="utf-8")
+        
+        app = web.Application()
+        app.router.add_get("/metrics", handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        self.server = runner
+    
+    async def close(self):
+        if self.server:
+            await self.server.cleanup()
+            self.server = None
+
+# ==================== SCHEDULER ====================
+SCHEDULER_LANES = ("cheap", "network", "bulk", "browser")
 
-def generate_qr_code(text):
-    if not QR_AVAILABLE:
-        return None
-    qr = qrcode.QRCode(version=1, error_correction=qrcode.constants.ERROR_CORRECT_L, box_size=10, border=4)
-    qr.add_data(text)
-    qr.make(fit=True)
-    img = qr.make_image(fill_color="black", back_color="white")
-    img_bytes = io.BytesIO()
-    img.save(img_bytes, format="PNG")
-    img_bytes.seek(0)
-    return img_bytes
+class SchedulerBusy(Exception):
+    """Raised when a lane already has `max_queue` jobs waiting for a slot"""
 
-def reverse_text(text):
-    return text[::-1]
+class JobTimeout(Exception):
+    """Raised when a job runs past its deadline"""
 
-def generate_fake_token():
-    user_id = ''.join(random.choices(string.ascii_letters + string.digits, k=18))
-    timestamp = ''.join(random.choices(string.ascii_letters + string.digits, k=10))
-    hmac = ''.join(random.choices(string.ascii_letters + string.digits, k=27))
-    return f"{user_id}.{timestamp}.{hmac}"
+class JobCancelled(Exception):
+    """Raised in the submitting coroutine when a job is aborted with `cancel`"""
 
-# ==================== SELENIUM SCRAPER ====================
-class SeleniumScraper:
-    def __init__(self, config):
-        self.config = config
-        self.driver = None
-        self.headless = config.get("selenium", {}).get("headless", True)
+class Job:
+    def __init__(self, job_id, name, lane, message, deadline, task):
+        self.id = job_id
+        self.name = name
+        self.lane = lane
+        self.channel = message.channel
+        self.deadline = deadline
+        self.task = task
+        self.created = time.monotonic()
+        self.started = None
+        self.expired = False
+        self.cancel_requested = False
+        self.cancels = 0
     
-    async def initialize_driver(self):
-        if not SELENIUM_AVAILABLE:
-            return False
+    def describe(self):
+        now = time.monotonic()
+        if self.started is None:
+            timing = f"queued {now - self.created:.1f}s"
+        else:
+            timing = f"running {now - self.started:.1f}s / {self.deadline:g}s"
+        where = getattr(self.channel, "name", None)
+        where = f"#{where}" if where else "DM"
+        return f"`#{self.id}` {self.name} · {self.lane} · {timing} · {where}"
+
+class CommandScheduler:
+    """Admits commands through per-lane concurrency caps and enforces their deadlines.
+    Lanes have separate slots, so cheap commands never queue behind browser or bulk work.
+    A job runs inline in the task that submitted it (discord.py gives every event its own task),
+    which keeps the cheap path free of extra tasks and timers; cancelling a job cancels that task.
+    Deadlines start once a job holds a slot and are checked by one reaper about once a second."""
+    def __init__(self, limits=None, timeouts=None, max_queue=16, reap_interval=1.0):
+        limits = limits or {}
+        self.timeouts = timeouts or {}
+        self.max_queue = max_queue
+        self.reap_interval = reap_interval
+        self.limits = {lane: max(1, limits.get(lane, 4)) for lane in SCHEDULER_LANES}
+        self.running = {lane: 0 for lane in SCHEDULER_LANES}
+        self.waiters = {lane: deque() for lane in SCHEDULER_LANES}
+        self.jobs = {}
+        self.next_id = 1
+        self.reaper = None
+        self.stats = {lane: {"completed": 0, "timed_out": 0, "cancelled": 0, "rejected": 0} for lane in SCHEDULER_LANES}
+    
+    async def run(self, name, lane, message, start, timeout=None):
+        """Run `start()` as job `name` in `lane` and return its result.
+        Raises SchedulerBusy, JobTimeout or JobCancelled; other exceptions propagate unchanged."""
+        if lane not in self.limits:
+            lane = "cheap"
+        stats = self.stats[lane]
+        if len(self.waiters[lane]) >= self.max_queue:
+            stats["rejected"] += 1
+            raise SchedulerBusy(f"Too many {lane} jobs queued, try again later")
+        job = Job(self.next_id, name, lane, message, timeout or self.timeouts.get(lane, 60), asyncio.current_task())
+        self.next_id += 1
+        self.jobs[job.id] = job
+        if self.reaper is None or self.reaper.done():
+            self.reaper = asyncio.ensure_future(self._reap())
+        acquired = False
         try:
-            chrome_options = Options()
-            if self.headless:
-                chrome_options.add_argument("--headless")
-            chrome_options.add_argument("--no-sandbox")
-            chrome_options.add_argument("--disable-dev-shm-usage")
-            chrome_options.add_argument("--disable-blink-features=AutomationControlled")
-            chrome_options.add_experimental_option("excludeSwitches", ["enable-automation", "enable-logging"])
-            chrome_options.add_argument("--log-level=3")
-            try:
-                driver_path = ChromeDriverManager().install()
-                service = Service(driver_path)
-                self.driver = webdriver.Chrome(service=service, options=chrome_options)
-            except:
-                self.driver = webdriver.Chrome(options=chrome_options)
-            self.driver.implicitly_wait(10)
-            self.driver.set_page_load_timeout(30)
-            return True
-        except:
-            return False
+            if self.running[lane] < self.limits[lane] and not self.waiters[lane]:
+                self.running[lane] += 1
+                job.started = job.created
+            else:
+                await self._wait_for_slot(lane)
+                job.started = time.monotonic()
+            acquired = True
+            result = await start()
+            if not (job.expired or job.cancel_requested):
+                stats["completed"] += 1
+                return result
+            # The job swallowed our CancelledError and ran on; still report how it was meant to end
+            self._raise_interrupted(job, stats)
+        except asyncio.CancelledError:
+            # Only translate cancellations we caused; a cancelled caller must still see CancelledError
+            if not (job.expired or job.cancel_requested):
+                raise
+            self._raise_interrupted(job, stats)
+        finally:
+            del self.jobs[job.id]
+            if acquired:
+                self._release(lane)
     
-    async def cleanup(self):
-        if self.driver:
-            try:
-                self.driver.quit()
-            except:
-                pass
-            self.driver = None
+    @staticmethod
+    def _raise_interrupted(job, stats):
+        uncancel = getattr(job.task, "uncancel", None)
+        if uncancel:
+            for _ in range(job.cancels):
+                uncancel()
+        if job.expired:
+            stats["timed_out"] += 1
+            raise JobTimeout(f"`{job.name}` timed out after {job.deadline:g}s (job #{job.id})") from None
+        stats["cancelled"] += 1
+        raise JobCancelled(f"Job #{job.id} (`{job.name}`) cancelled") from None
     
-    async def take_screenshot(self, url, save_path):
-        if not self.driver:
-            if not await self.initialize_driver():
-                return None
+    @asynccontextmanager
+    async def escalate(self, lane):
+        """Hold a slot in `lane` for the heavy part of the current job, e.g. a scrape falling back to a browser.
+        Once the slot is granted the job is shown in that lane and its deadline restarts with the lane's timeout."""
+        job = next((job for job in self.jobs.values() if job.task is asyncio.current_task()), None)
+        if self.running[lane] < self.limits[lane] and not self.waiters[lane]:
+            self.running[lane] += 1
+        elif len(self.waiters[lane]) >= self.max_queue:
+            self.stats[lane]["rejected"] += 1
+            raise SchedulerBusy(f"Too many {lane} jobs queued, try again later")
+        else:
+            await self._wait_for_slot(lane)
+        previous_lane = job.lane if job else None
+        if job:
+            job.lane, job.started, job.deadline = lane, time.monotonic(), self.timeouts.get(lane, job.deadline)
         try:
-            self.driver.get(url)
-            await asyncio.sleep(3)
-            os.makedirs(os.path.dirname(save_path) if os.path.dirname(save_path) else ".", exist_ok=True)
-            self.driver.save_screenshot(save_path)
-            return save_path
-        except:
-            return None
+            yield
+        finally:
+            self._release(lane)
+            if job:
+                job.lane = previous_lane
     
-    async def scrape_website_content(self, url, selectors):
-        if not self.driver:
-            if not await self.initialize_driver():
-                return {}
+    async def _wait_for_slot(self, lane):
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters[lane].append(waiter)
         try:
-            self.driver.get(url)
-            await asyncio.sleep(3)
-            results = {}
-            for key, selector in selectors.items():
-                try:
-                    element = WebDriverWait(self.driver, 10).until(EC.presence_of_element_located((By.CSS_SELECTOR, selector)))
-                    results[key] = element.text if element.text else element.get_attribute("innerHTML")
-                except:
-                    results[key] = None
-            return results
-        except:
-            return {}
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as we were cancelled; pass it on
+                self._release(lane)
+            elif waiter in self.waiters[lane]:
+                self.waiters[lane].remove(waiter)
+            raise
     
-    async def download_file(self, url, save_path):
-        if not self.driver:
-            if not await self.initialize_driver():
-                return None
+    def _release(self, lane):
+        waiters = self.waiters[lane]
+        while waiters:
+            waiter = waiters.popleft()
+            if not waiter.done():
+                # Hand the slot straight to the next waiter so the running count never dips
+                waiter.set_result(None)
+                return
+        self.running[lane] -= 1
+    
+    async def _reap(self):
+        while self.jobs:
+            await asyncio.sleep(self.reap_interval)
+            now = time.monotonic()
+            for job in list(self.jobs.values()):
+                # Keep cancelling every pass: code that swallows one CancelledError must not outlive its deadline
+                if job.started is not None and now - job.started >= job.deadline:
+                    job.expired = True
+                    self._interrupt(job)
+    
+    def cancel(self, job_id):
+        """Abort a queued or running job; returns the Job, or None if it is not known"""
+        job = self.jobs.get(job_id)
+        if job:
+            job.cancel_requested = True
+            self._interrupt(job)
+        return job
+    
+    @staticmethod
+    def _interrupt(job):
+        if job.task.cancel():
+            job.cancels += 1
+    
+    def cancel_all(self):
+        """Abort every job except the one calling this"""
+        current = asyncio.current_task()
+        return [self.cancel(job.id) for job in list(self.jobs.values()) if job.task is not current]
+    
+    def queued(self, lane):
+        return len(self.waiters[lane])
+    
+    def summary(self):
+        lines = []
+        for lane in SCHEDULER_LANES:
+            stats = self.stats[lane]
+            lines.append(f"{lane}: {self.running[lane]}/{self.limits[lane]} running, {self.queued(lane)} queued · "
+                         f"{stats['completed']} done, {stats['timed_out']} timed out, {stats['cancelled']} cancelled, {stats['rejected']} rejected")
+        return lines
+
+# ==================== EDIT COALESCER ====================
+class PendingEdit:
+    def __init__(self):
+        self.content = None
+        self.handle = None
+        self.task = None
+        self.last_sent = None
+
+class EditCoalescer:
+    """Debounces progress edits per message and always lets the final text win.
+    A status update waits `grace` seconds before it is sent (then at most one per `interval`),
+    newer text replaces older unsent text, and a final edit arriving first drops it outright.
+    Messages whose edit returned 404 are remembered so later updates skip the doomed edit."""
+    def __init__(self, bot, grace=0.5, interval=1.0, remember=1024):
+        self.bot = bot
+        self.grace = grace
+        self.interval = interval
+        self.remember = remember
+        self.entries = {}
+        self.gone = OrderedDict()
+        self.stats = {"status": 0, "final": 0, "edits": 0, "sends": 0, "saved": 0}
+    
+    def status(self, message, content):
+        """Queue intermediate text for `message`; returns immediately"""
+        self.stats["status"] += 1
+        entry = self.entries.get(message.id)
+        if entry is None:
+            entry = self.entries[message.id] = PendingEdit()
+        if entry.content is not None:
+            self.stats["saved"] += 1
+        entry.content = content
+        if entry.handle is None and entry.task is None:
+            self._schedule(message, entry)
+    
+    def _schedule(self, message, entry):
+        delay = self.grace if entry.last_sent is None else max(0.0, self.interval - (time.monotonic() - entry.last_sent))
+        entry.handle = asyncio.get_running_loop().call_later(delay, self._flush, message, entry)
+    
+    def _flush(self, message, entry):
+        entry.handle = None
+        content, entry.content = entry.content, None
+        entry.task = asyncio.ensure_future(self._deliver(message, content, final=False))
+        entry.task.add_done_callback(lambda task: self._flushed(message, entry))
+    
+    def _flushed(self, message, entry):
+        entry.task = None
+        entry.last_sent = time.monotonic()
+        if self.entries.get(message.id) is not entry:
+            return
+        if entry.content is not None:
+            self._schedule(message, entry)
+        else:
+            del self.entries[message.id]
+    
+    async def final(self, message, content):
+        """Deliver the result, dropping any status still waiting and landing after one in flight"""
+        self.stats["final"] += 1
+        entry = self.entries.pop(message.id, None)
+        if entry is not None:
+            if entry.handle is not None:
+                entry.handle.cancel()
+            if entry.content is not None:
+                self.stats["saved"] += 1
+            if entry.task is not None:
+                await entry.task
+        await self._deliver(message, content, final=True)
+    
+    async def _deliver(self, message, content, final):
+        # Catch Exception only, so a scheduler cancel can still interrupt a pending edit
+        if message.author.id == self.bot.user.id:
+            if message.id in self.gone:
+                self.stats["saved"] += 1
+            else:
+                try:
+                    await message.edit(content=content)
+                    self.stats["edits"] += 1
+                    return
+                except discord.NotFound:
+                    self.gone[message.id] = True
+                    if len(self.gone) > self.remember:
+                        self.gone.popitem(last=False)
+                except Exception:
+                    pass
+            if not final:
+                # Progress text is not worth a fresh message
+                return
         try:
-            self.driver.get(url)
-            await asyncio.sleep(2)
-            return save_path if os.path.exists(save_path) else None
-        except:
-            return None
+            await message.channel.send(content)
+            self.stats["sends"] += 1
+        except Exception:
+            pass
+
+# ==================== COMMAND REGISTRY ====================
+def command(*aliases, args=True, options=None, flags=None, lane="cheap", timeout=None):
+    """Register a CommandHandler method as a command.
+    `options` maps spellings like "--wait" to keyword arguments taking the next token,
+    `flags` maps spellings like "--fresh" to keyword arguments set to True.
+    `lane` picks the scheduler lane (cheap, network, bulk, browser) and `timeout` overrides its deadline."""
+    def decorator(func):
+        func.command_spec = {"name": func.__name__[len("cmd_"):], "aliases": aliases, "args": args, "options": options or {}, "flags": flags or {}, "lane": lane, "timeout": timeout}
+        return func
+    return decorator
+
+def build_arg_parser(options, flags):
+    """Compile an option/flag schema into a function returning (positional_args, kwargs)"""
+    if not options and not flags:
+        return None
+    
+    def parse(args):
+        rest = []
+        kwargs = {}
+        i = 0
+        count = len(args)
+        while i < count:
+            arg = args[i]
+            if arg in flags:
+                kwargs[flags[arg]] = True
+            elif arg in options and i + 1 < count:
+                i += 1
+                kwargs[options[arg]] = args[i]
+            else:
+                rest.append(arg)
+            i += 1
+        return rest, kwargs
+    return parse
+
+def build_invoker(method, spec):
+    """Wrap a bound command method so every command is called as `invoker(message, args)`"""
+    if not spec["args"]:
+        return lambda message, args: method(message)
+    parse = build_arg_parser(spec["options"], spec["flags"])
+    if parse is None:
+        return method
+    
+    def invoke(message, args):
+        rest, kwargs = parse(args)
+        return method(message, rest, **kwargs)
+    return invoke
+
+# ==================== MESSAGE FILTER ====================
+ROUTE_DROP = 0
+ROUTE_COMMAND = 1
+ROUTE_PASSIVE = 2
+
+class MessageFilter:
+    """Precomputed routing state for on_message; rebuilt only when the state it mirrors changes"""
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.self_id = None
+        self.remote_users = frozenset()
+        self.copycat_users = frozenset()
+        self.afk = False
+        self.passive = False
+        self.stats = {"filtered": 0, "commands": 0, "passive": 0}
+    
+    def rebuild(self, self_id, remote_users, copycat_users, afk_users):
+        remote_ids = set()
+        for user_id in remote_users:
+            try:
+                remote_ids.add(int(user_id))
+            except ValueError:
+                pass
+        self.self_id = self_id
+        self.remote_users = frozenset(remote_ids)
+        self.copycat_users = frozenset(copycat_users)
+        self.afk = self_id in afk_users
+        self.passive = bool(self.copycat_users) or self.afk
+    
+    def route(self, message):
+        author_id = message.author.id
+        if message.content.startswith(self.prefix):
+            if author_id == self.self_id or not self.remote_users or author_id in self.remote_users:
+                self.stats["commands"] += 1
+                return ROUTE_COMMAND
+        elif self.passive and author_id != self.self_id:
+            self.stats["passive"] += 1
+            return ROUTE_PASSIVE
+        self.stats["filtered"] += 1
+        return ROUTE_DROP
 
 # ==================== COMMAND HANDLER ====================
 class CommandHandler:
@@ -294,81 +2788,122 @@ class CommandHandler:
         self.config = config
         self.start_time = start_time
         self.bot_instance = bot_instance
+        self.http = bot_instance.http_client if bot_instance else HTTPClient(config)
         self.scraper = SeleniumScraper(config) if SELENIUM_AVAILABLE else None
+        geoip_config = config.get("geoip", {})
+        try:
+            geoip_backend = make_geoip_backend(config, self.http)
+        except Exception as e:
+            print(f"⚠️  GeoIP backend unavailable ({e}), using ip-api.com")
+            geoip_backend = IpApiBackend(self.http, geoip_config.get("api_url", "http://ip-api.com"))
+        self.geoip = GeoIPCache(geoip_backend, geoip_config.get("cache_path"), geoip_config.get("ttl", 86400), geoip_config.get("max_entries", 1024))
+        cache_config = config.get("capture_cache", {})
+        self.downloader = Downloader(self.http, config)
+        self.http_scraper = HTTPScraper(self.http)
+        self.capture_cache = CaptureCache(cache_config.get("path", os.path.join("data", "captures.db")), cache_config.get("ttl", 3600), cache_config.get("max_bytes", 200 * 1024 * 1024))
+        qr_config = config.get("qr", {})
+        self.qr_renderer = QRRenderer(qr_config.get("workers", 2), qr_config.get("cache_size", 128))
         self.afk_users = {}
         self.copycat_users = set()
+        self.state = bot_instance.state if bot_instance else None
+        self.load_state()
+        self.metrics = bot_instance.metrics if bot_instance else CommandMetrics()
+        self.message_filter = MessageFilter(config.get("prefix", "."))
+        edit_config = config.get("edits", {})
+        self.edits = EditCoalescer(bot, edit_config.get("grace", 0.5), edit_config.get("interval", 1.0))
+        index_config = config.get("message_index", {})
+        self.message_index = MessageIndex(index_config.get("path", os.path.join("data", "messages.db")), index_config.get("flush_interval", 2.0)) if index_config.get("enabled", True) else None
+        self.deletion_engine = DeletionEngine(bot, bot_instance.rate_limits if bot_instance else RateLimitObserver(), config, self.message_index)
         
-        self.command_map = {
-            "help": self.cmd_help, "h": self.cmd_help,
-            "shutdown": self.cmd_shutdown,
-            "uptime": self.cmd_uptime,
-            "ping": self.cmd_ping,
-            "remoteuser": self.cmd_remoteuser,
-            "copycat": self.cmd_copycat,
-            "pingweb": self.cmd_pingweb,
-            "geoip": self.cmd_geoip,
-            "qr": self.cmd_qr,
-            "reverse": self.cmd_reverse,
-            "edit": self.cmd_edit,
-            "hidemention": self.cmd_hidemention,
-            "screenshot": self.cmd_screenshot,
-            "scrape": self.cmd_scrape,
-            "download": self.cmd_download,
-            "purge": self.cmd_purge,
-            "clear": self.cmd_clear,
-            "cleardm": self.cmd_cleardm,
-            "spam": self.cmd_spam,
-            "quickdelete": self.cmd_quickdelete,
-            "autoreply": self.cmd_autoreply,
-            "afk": self.cmd_afk,
-            "guildinfo": self.cmd_guildinfo,
-            "guildicon": self.cmd_guildicon,
-            "guildbanner": self.cmd_guildbanner,
-            "guildrename": self.cmd_guildrename,
-            "fetchmembers": self.cmd_fetchmembers,
-            "usericon": self.cmd_usericon,
-            "dmall": self.cmd_dmall,
-            "sendall": self.cmd_sendall,
-            "playing": self.cmd_playing,
-            "watching": self.cmd_watching,
-            "stopactivity": self.cmd_stopactivity,
-            "gentoken": self.cmd_gentoken,
-            "hypesquad": self.cmd_hypesquad,
-            "nitro": self.cmd_nitro,
-            "ascii": self.cmd_ascii,
-            "minesweeper": self.cmd_minesweeper,
-            "leetpeek": self.cmd_leetpeek,
-            "whremove": self.cmd_whremove,
-            "firstmessage": self.cmd_firstmessage,
-            "test": self.cmd_test, "testcommands": self.cmd_test,
-        }
+        scheduler_config = config.get("scheduler", {})
+        self.scheduler = CommandScheduler(scheduler_config.get("limits"), scheduler_config.get("timeouts"), scheduler_config.get("max_queue", 16))
+        
+        self.command_map = {}
+        self.command_lanes = {}
+        for attr in dir(type(self)):
+            spec = getattr(getattr(type(self), attr), "command_spec", None)
+            if spec:
+                invoker = build_invoker(getattr(self, attr), spec)
+                for name in (spec["name"],) + spec["aliases"]:
+                    self.command_map[name] = invoker
+                    self.command_lanes[name] = (spec["lane"], spec["timeout"])
+    
+    def load_state(self):
+        """Rehydrate runtime toggles persisted by earlier sessions"""
+        if not self.state:
+            return
+        if self.state.get("remote-users") is not None:
+            # REMOTE_USERS always applies; users added at runtime with `remoteuser ADD` are kept on top of it
+            configured = self.config.get("remote-users", [])
+            self.config["remote-users"] = configured + [user_id for user_id in self.state.get("remote-users") if user_id not in configured]
+        self.afk_users = {int(user_id): text for user_id, text in self.state.get("afk_users", {}).items()}
+        self.copycat_users = set(self.state.get("copycat_users", []))
+        activity = self.state.get("activity")
+        if activity:
+            self.bot.initial_activity = self.make_activity(activity["type"], activity["name"])
+    
+    def persist(self, key, value):
+        if self.state:
+            self.state.set(key, value)
+    
+    @staticmethod
+    def make_activity(kind, name):
+        if kind == "watching":
+            return discord.Activity(type=discord.ActivityType.watching, name=name)
+        return discord.Game(name=name)
+    
+    def refresh_filter(self):
+        """Rebuild the on_message pre-filter after remote/copycat/AFK state changes"""
+        self.message_filter.rebuild(self.bot.user.id if self.bot.user else None, self.config.get("remote-users", []), self.copycat_users, self.afk_users)
     
     async def safe_edit(self, message, content):
-        if message.author.id == self.bot.user.id:
-            try:
-                await message.edit(content=content)
-            except:
-                try:
-                    await message.channel.send(content)
-                except:
-                    pass
-        else:
-            try:
-                await message.channel.send(content)
-            except:
-                pass
+        await self.edits.final(message, content)
     
-    async def handle_command(self, message, command, args):
-        command = command.lower()
-        handler = self.command_map.get(command)
-        if handler:
-            if command in ("shutdown", "uptime", "ping", "guildinfo", "guildicon", "guildbanner", "fetchmembers", "stopactivity", "gentoken", "nitro", "firstmessage", "test", "testcommands"):
-                await handler(message)
+    async def send_long(self, message, text, fence=""):
+        """Deliver text past the message limit: the first chunk replaces the command, the rest follow"""
+        limit = MESSAGE_LIMIT - (2 * len(fence) + 2 if fence else 0)
+        chunks = split_message(text, limit)
+        dropped = len(chunks) - TRANSFORM_MAX_CHUNKS
+        chunks = chunks[:TRANSFORM_MAX_CHUNKS]
+        if fence:
+            chunks = [f"{fence}\n{chunk}\n{fence}" for chunk in chunks]
+        if dropped > 0:
+            notice = f"⚠️ Output truncated, {dropped} more part{'s' if dropped != 1 else ''} not sent"
+            if len(chunks[-1]) + 1 + len(notice) <= MESSAGE_LIMIT:
+                chunks[-1] += "\n" + notice
             else:
-                await handler(message, args)
-            return True
-        return False
+                chunks.append(notice)
+        await self.safe_edit(message, chunks[0])
+        for chunk in chunks[1:]:
+            await message.channel.send(chunk)
+    
+    def progress(self, message, content):
+        """Show a working status; coalesced, and skipped entirely if the result follows quickly"""
+        self.edits.status(message, content)
+    
+    async def handle_command(self, message, command, args):
+        name = command.lower()
+        invoker = self.command_map.get(name)
+        if invoker is None:
+            return False
+        lane, timeout = self.command_lanes[name]
+        timings = {"rest": 0.0, "blocking": []}
+        token = CURRENT_COMMAND.set(name)
+        timings_token = COMMAND_TIMINGS.set(timings)
+        started = time.perf_counter()
+        error = None
+        try:
+            await self.scheduler.run(name, lane, message, lambda: invoker(message, args), timeout)
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            self.metrics.observe(name, time.perf_counter() - started, timings, error)
+            COMMAND_TIMINGS.reset(timings_token)
+            CURRENT_COMMAND.reset(token)
+        return True
     
+    @command("h")
     async def cmd_help(self, message, args):
         prefix = self.config.get("prefix", "*")
         help_text = f"""```yaml
@@ -380,6 +2915,12 @@ class CommandHandler:
 {prefix}help - Show this menu
 {prefix}ping - Check latency
 {prefix}uptime - Show uptime
+{prefix}msgstats - Messages filtered vs processed, edits saved
+{prefix}memstats - Approximate memory per client cache
+{prefix}lag [stack] - Event loop lag and stalls per command
+{prefix}stats [command] - Command latency (total/REST/blocking) and errors
+{prefix}jobs - Running and queued commands per lane
+{prefix}cancel <id|all> - Abort a running or queued command
 {prefix}shutdown - Stop bot
 
 [User Management]
@@ -387,20 +2928,23 @@ class CommandHandler:
 {prefix}copycat ON|OFF <@user> - Copy user messages
 
 [Web]
-{prefix}pingweb <url> - Ping website
-{prefix}geoip <ip> - IP lookup
-{prefix}qr <text> - Generate QR code
-{prefix}screenshot <url> - Screenshot website
-{prefix}scrape <url> - Scrape website
+{prefix}pingweb <url...> [-n samples] - Ping websites
+{prefix}geoip <ip> [ip...] - IP lookup
+{prefix}qr <text> [--ec L|M|Q|H] [--size 1-40] [--svg|--small] [--batch a | b | c] - Generate QR code
+{prefix}screenshot <url> [--wait ready|idle|selector:<css>|<sec>] [--size WxH] [--full] [--fresh] - Screenshot website
+{prefix}scrape <url> [--select <css>] [--wait ...] [--browser] [--fresh] - Scrape website
 {prefix}download <url> - Download file from URL
+{prefix}cache [stats|clear] - Screenshot/scrape cache
 
 [Message]
 {prefix}reverse <text> - Reverse text
 {prefix}edit <text> - Edit message
 {prefix}hidemention <text> - Hide mentions
-{prefix}purge <amount> - Delete messages
-{prefix}clear <amount> - Clear messages
-{prefix}cleardm <amount> - Clear DMs
+{prefix}t <leet|reverse|hidemention|ascii> <text> - Chain transforms, e.g. t leet|reverse hello
+{prefix}purge <amount|resume> [--author me|all|<@user>] [--before 2h] [--after 1d] [--contains <text>] - Delete messages
+{prefix}clear <amount> [filters] - Clear messages (default 100)
+{prefix}cleardm <amount> [filters] - Clear DMs
+{prefix}index [stats|backfill [limit]|compact] - Index own messages for fast cleanup
 
 [Automation]
 {prefix}spam <amount> <message> - Spam messages
@@ -413,7 +2957,7 @@ class CommandHandler:
 {prefix}guildicon - Server icon
 {prefix}guildbanner - Server banner
 {prefix}guildrename <name> - Rename server
-{prefix}usericon <@user> - User avatar
+{prefix}usericon <@user|id> - User avatar
 {prefix}fetchmembers - Get all server members
 {prefix}dmall <message> - DM all members
 {prefix}sendall <message> - Send to all channels
@@ -428,7 +2972,7 @@ class CommandHandler:
 {prefix}hypesquad <house> - Change badge
 {prefix}nitro - Fake nitro
 {prefix}ascii <text> - ASCII art
-{prefix}minesweeper <width> <height> - Play game
+{prefix}minesweeper [width] [height] [mines] [--seed n] - Play game
 {prefix}leetpeek <text> - Leet speak
 
 [Webhooks]
@@ -440,20 +2984,117 @@ class CommandHandler:
 ```"""
         await self.safe_edit(message, help_text)
     
+    @command(args=False)
     async def cmd_shutdown(self, message):
         await self.safe_edit(message, "🛑 Shutting down...")
+        self.scheduler.cancel_all()
         if self.scraper:
             await self.scraper.cleanup()
+        await self.geoip.close()
+        self.capture_cache.close()
+        if self.message_index:
+            await self.message_index.flush()
+            self.message_index.close()
+        self.qr_renderer.close()
+        if self.bot_instance and self.bot_instance.loop_monitor:
+            self.bot_instance.loop_monitor.stop()
+        await self.metrics.close()
+        if self.state:
+            await self.state.flush()
+        await self.http.close()
         await self.bot.close()
     
+    @command(args=False)
     async def cmd_uptime(self, message):
         uptime = get_uptime(self.start_time)
         await self.safe_edit(message, f"⏱️ Uptime: {uptime}")
     
+    @command(args=False)
+    async def cmd_msgstats(self, message):
+        stats = self.message_filter.stats
+        total = sum(stats.values())
+        filtered_pct = stats["filtered"] / total * 100 if total else 0
+        edits = self.edits.stats
+        await self.safe_edit(message, f"📨 {total} messages seen\n🚫 {stats['filtered']} filtered ({filtered_pct:.1f}%)\n⚙️ {stats['commands']} commands | 👀 {stats['passive']} passive\n✏️ {edits['edits']} edits, {edits['sends']} sends | {edits['saved']} REST calls saved by coalescing")
+    
+    @command()
+    async def cmd_lag(self, message, args):
+        monitor = self.bot_instance.loop_monitor if self.bot_instance else None
+        if not monitor or not monitor.samples:
+            await self.safe_edit(message, "❌ Loop monitor not running")
+            return
+        lines = [
+            f"⏲️ Loop lag over {monitor.samples} samples: p50 ≤{monitor.percentile_ms(50):.0f}ms | p99 ≤{monitor.percentile_ms(99):.0f}ms | max {monitor.max_lag * 1000:.0f}ms",
+            f"⚠️ {sum(entry['count'] for entry in monitor.by_command.values())} stalls over {monitor.threshold * 1000:.0f}ms",
+        ]
+        worst = sorted(monitor.by_command.items(), key=lambda item: item[1]["total_ms"], reverse=True)[:5]
+        for name, entry in worst:
+            lines.append(f"• `{name}`: {entry['count']}x, max {entry['max_ms']:.0f}ms, total {entry['total_ms']:.0f}ms")
+        if args and args[0].lower() == "stack" and monitor.stalls:
+            stall = monitor.stalls[-1]
+            stack = "".join(stall["stack"][-6:]) or "(no snapshot)"
+            lines.append(f"Last stall: {stall['lag_ms']:.0f}ms in `{stall['command']}`\n```py\n{stack[-1500:]}```")
+        await self.safe_edit(message, "\n".join(lines))
+    
+    @command()
+    async def cmd_stats(self, message, args):
+        commands = self.metrics.commands
+        if args:
+            entry = commands.get(args[0].lower())
+            if not entry:
+                await self.safe_edit(message, f"❌ No calls recorded for `{args[0]}`")
+                return
+            lines = [f"📊 `{args[0].lower()}`: {entry['calls']} calls"]
+            for phase, histogram in entry["phases"].items():
+                lines.append(f"• {phase}: p50 {histogram.quantile(0.5) * 1000:.0f}ms | p95 {histogram.quantile(0.95) * 1000:.0f}ms | avg {histogram.sum / histogram.count * 1000:.0f}ms")
+            if entry["errors"]:
+                lines.append("❌ " + ", ".join(f"{error} ×{count}" for error, count in sorted(entry["errors"].items(), key=lambda item: -item[1])))
+            await self.safe_edit(message, "\n".join(lines))
+            return
+        if not commands:
+            await self.safe_edit(message, "📊 No commands recorded yet")
+            return
+        lines = ["📊 Command stats (p95 total | avg REST | avg blocking)"]
+        ranked = sorted(commands.items(), key=lambda item: item[1]["phases"]["total"].quantile(0.95), reverse=True)
+        for name, entry in ranked[:15]:
+            phases = entry["phases"]
+            errors = sum(entry["errors"].values())
+            lines.append(f"• `{name}` ×{entry['calls']}: {phases['total'].quantile(0.95) * 1000:.0f}ms | {phases['rest'].sum / entry['calls'] * 1000:.0f}ms | {phases['blocking'].sum / entry['calls'] * 1000:.0f}ms" + (f" | ❌ {errors}" if errors else ""))
+        await self.safe_edit(message, "\n".join(lines))
+
+    @command(args=False)
+    async def cmd_jobs(self, message):
+        current = asyncio.current_task()
+        jobs = [job for job in self.scheduler.jobs.values() if job.task is not current]
+        lines = [f"📋 Jobs: {len(jobs)} active"]
+        lines += [f"• {job.describe()}" for job in sorted(jobs, key=lambda job: job.id)[:20]]
+        lines.append("```" + "\n".join(self.scheduler.summary()) + "```")
+        await self.safe_edit(message, "\n".join(lines))
+    
+    @command()
+    async def cmd_cancel(self, message, args):
+        if not args:
+            await self.safe_edit(message, "❌ Usage: cancel <id|all>")
+            return
+        if args[0].lower() == "all":
+            cancelled = self.scheduler.cancel_all()
+            await self.safe_edit(message, f"🛑 Cancelled {len(cancelled)} job(s)")
+            return
+        try:
+            job = self.scheduler.cancel(int(args[0].lstrip("#")))
+        except ValueError:
+            job = None
+        if job is None:
+            await self.safe_edit(message, f"❌ No active job `{args[0]}`")
+            return
+        await self.safe_edit(message, f"🛑 Cancelled job #{job.id} (`{job.name}`)")
+    
+    @command(args=False)
     async def cmd_ping(self, message):
         latency = round(self.bot.latency * 1000, 2)
         await self.safe_edit(message, f"🏓 Pong! {latency}ms")
     
+    @command()
     async def cmd_remoteuser(self, message, args):
         if len(args) < 2:
             await self.safe_edit(message, "❌ Usage: `remoteuser ADD|REMOVE <@user>`")
@@ -469,8 +3110,10 @@ class CommandHandler:
                 remote_users.remove(user_id)
                 await self.safe_edit(message, f"✅ Removed {user.mention}")
         self.config["remote-users"] = remote_users
-        save_config(self.config)
+        self.persist("remote-users", remote_users)
+        self.refresh_filter()
     
+    @command()
     async def cmd_copycat(self, message, args):
         if len(args) < 2 or not message.mentions:
             await self.safe_edit(message, "❌ Usage: `copycat ON|OFF <@user>`")
@@ -479,178 +3122,358 @@ class CommandHandler:
         user_id = message.mentions[0].id
         if mode == "ON":
             self.copycat_users.add(user_id)
+            self.persist("copycat_users", sorted(self.copycat_users))
+            self.refresh_filter()
             await self.safe_edit(message, f"✅ Copycat ON for {message.mentions[0].mention}")
         elif mode == "OFF":
             self.copycat_users.discard(user_id)
+            self.persist("copycat_users", sorted(self.copycat_users))
+            self.refresh_filter()
             await self.safe_edit(message, f"✅ Copycat OFF")
     
-    async def cmd_pingweb(self, message, args):
-        if not args:
-            await self.safe_edit(message, "❌ Provide URL")
+    @command(options={"-n": "samples", "--samples": "samples"}, lane="network")
+    async def cmd_pingweb(self, message, urls, samples="1"):
+        samples = min(max(int(samples), 1), PING_MAX_SAMPLES) if samples.isdigit() else 1
+        if not urls:
+            await self.safe_edit(message, "❌ Usage: `pingweb <url> [url...] [-n samples]`")
             return
-        result = ping_website(args[0])
-        if result.get("online"):
-            await self.safe_edit(message, f"🌐 {args[0]}\n✅ {result['status_code']} | {result['response_time']}")
-        else:
-            await self.safe_edit(message, f"❌ Offline")
+        self.progress(message, f"🌐 Probing {len(urls[:PING_MAX_URLS])} URL(s) x{samples}...")
+        results = await ping_websites(urls[:PING_MAX_URLS], samples)
+        blocks = []
+        for result in results:
+            if not result["online"] and not result.get("stats"):
+                blocks.append(f"❌ {result['url']} - Offline ({result.get('error') or 'no response'})")
+                continue
+            icon = "✅" if result["online"] else "⚠️"
+            lines = [f"{'phase':<10}{'min':>9}{'p50':>9}{'p95':>9}{'max':>9}"]
+            for phase in PING_PHASES:
+                stat = result["stats"][phase]
+                lines.append(f"{phase:<10}{stat['min']:>9.1f}{stat['p50']:>9.1f}{stat['p95']:>9.1f}{stat['max']:>9.1f}")
+            table = "\n".join(lines)
+            redirect = f" → {result['final_url']}" if result["final_url"] != result["url"] else ""
+            blocks.append(f"{icon} {result['url']}{redirect} | {result['status_code']} | {result['samples']}/{samples} samples (ms)\n```\n{table}\n```")
+        chunks = pack_blocks(blocks)
+        await self.safe_edit(message, chunks[0])
+        for chunk in chunks[1:]:
+            await message.channel.send(chunk)
     
+    @command(lane="network")
     async def cmd_geoip(self, message, args):
         if not args:
             await self.safe_edit(message, "❌ Provide IP")
             return
-        result = geoip_lookup(args[0])
-        if "error" in result:
-            await self.safe_edit(message, f"❌ {result['error']}")
-        else:
-            info = f"🌍 {args[0]}\n📍 {result.get('country', 'N/A')}\n🏙️ {result.get('city', 'N/A')}\n🌐 {result.get('isp', 'N/A')}"
-            await self.safe_edit(message, info)
+        results = await self.geoip.lookup(args)
+        if len(results) == 1:
+            ip, result = next(iter(results.items()))
+            if "error" in result:
+                await self.safe_edit(message, f"❌ {result['error']}")
+            else:
+                info = f"🌍 {ip}\n📍 {result.get('country') or 'N/A'}\n🏙️ {result.get('city') or 'N/A'}\n🌐 {result.get('isp') or 'N/A'}"
+                await self.safe_edit(message, info)
+            return
+        lines = []
+        for ip, result in results.items():
+            if "error" in result:
+                lines.append(f"❌ {ip} - {result['error']}")
+            else:
+                lines.append(f"🌍 {ip} - {result.get('country') or 'N/A'}, {result.get('city') or 'N/A'} - {result.get('isp') or 'N/A'}")
+        await self.safe_edit(message, "\n".join(lines)[:2000])
     
-    async def cmd_qr(self, message, args):
+    @command(options={"--ec": "ec", "--size": "size"}, flags={"--svg": "svg", "--small": "small", "--batch": "batch"})
+    async def cmd_qr(self, message, args, ec="M", size="10", svg=False, small=False, batch=False):
         if not args or not QR_AVAILABLE:
             await self.safe_edit(message, "❌ Provide text" if args else "❌ QR code not available")
             return
-        qr_img = generate_qr_code(" ".join(args))
-        if qr_img:
-            await self.safe_edit(message, "📱 QR Code:")
-            await message.channel.send(file=discord.File(qr_img, filename="qrcode.png"))
+        ec = ec.upper()
+        if len(ec) != 1 or ec not in QR_ERROR_LEVELS:
+            await self.safe_edit(message, "❌ Error correction must be L, M, Q or H")
+            return
+        if not size.isdigit() or not 1 <= int(size) <= QR_MAX_BOX_SIZE:
+            await self.safe_edit(message, f"❌ Size must be 1-{QR_MAX_BOX_SIZE}")
+            return
+        fmt = "svg" if svg else "small" if small else "png"
+        text = " ".join(args)
+        try:
+            if batch:
+                texts = [part.strip() for part in text.split("|") if part.strip()][:QR_BATCH_MAX]
+                # A sheet is always a PNG, SVG only applies to single codes
+                data = await self.qr_renderer.render_sheet(texts, ec, int(size), "small" if small else "png")
+                label, filename = f"{len(texts)} QR Codes", "qrcodes.png"
+            else:
+                data = await self.qr_renderer.render(text, ec, int(size), fmt)
+                label, filename = "QR Code", "qrcode.svg" if svg else "qrcode.png"
+        except Exception as e:
+            # qrcode raises when the text does not fit even the largest (version 40) code
+            await self.safe_edit(message, f"❌ {type(e).__name__}: {e}")
+            return
+        if data:
+            await self.safe_edit(message, f"📱 {label}:")
+            await message.channel.send(file=discord.File(io.BytesIO(data), filename=filename))
     
+    @command()
     async def cmd_reverse(self, message, args):
         if not args:
             await self.safe_edit(message, "❌ Provide text")
             return
-        await self.safe_edit(message, reverse_text(" ".join(args)))
+        await self.send_long(message, reverse_text(" ".join(args)))
     
+    @command()
     async def cmd_edit(self, message, args):
         if not args:
             await self.safe_edit(message, "❌ Provide text")
             return
         await self.safe_edit(message, f"{' '.join(args)} (edited)")
     
+    @command()
     async def cmd_hidemention(self, message, args):
         if not args:
             await self.safe_edit(message, "❌ Provide text")
             return
-        hidden = " ".join(args).replace("@", "@\u200b")
-        await self.safe_edit(message, hidden)
+        await self.send_long(message, hide_mentions(" ".join(args)))
+    
+    @command("t")
+    async def cmd_transform(self, message, args):
+        if len(args) < 2:
+            await self.safe_edit(message, f"❌ Usage: `t <{'|'.join(TEXT_TRANSFORMS)}> <text>`")
+            return
+        try:
+            steps = compile_transforms(args[0])
+        except ValueError as e:
+            await self.safe_edit(message, f"❌ {e}")
+            return
+        await self.send_long(message, apply_transforms(steps, " ".join(args[1:])))
     
-    async def cmd_screenshot(self, message, args):
+    @command(options={"--wait": "wait", "--size": "size"}, flags={"--fresh": "fresh", "--full": "full_page"}, lane="browser")
+    async def cmd_screenshot(self, message, args, wait=None, size=None, fresh=False, full_page=False):
         if not args or not self.scraper:
             await self.safe_edit(message, "❌ Provide URL" if args else "❌ Selenium not available")
             return
         url = args[0]
-        await self.safe_edit(message, "📸 Taking screenshot...")
-        os.makedirs("temp", exist_ok=True)
-        filepath = f"temp/screenshot_{int(time.time())}.png"
-        screenshot_path = await self.scraper.take_screenshot(url, filepath)
-        if screenshot_path and os.path.exists(screenshot_path):
-            await self.safe_edit(message, f"📸 Screenshot:")
-            await message.channel.send(file=discord.File(screenshot_path))
-            await asyncio.sleep(5)
-            try:
-                os.remove(screenshot_path)
-            except:
-                pass
+        try:
+            wait = parse_wait_strategy(wait, self.scraper.wait_timeout) if wait else None
+            viewport = parse_viewport(size) if size else None
+            cache_key = CaptureCache.make_key("screenshot", url, wait=wait or self.scraper.wait_strategy, viewport=viewport or self.scraper.viewport, full_page=full_page)
+        except ValueError as e:
+            await self.safe_edit(message, f"❌ {e}")
+            return
+        data = None if fresh else await self.capture_cache.get(cache_key)
+        if data is not None:
+            status = "cached"
         else:
-            await self.safe_edit(message, "❌ Failed")
+            self.progress(message, "📸 Taking screenshot...")
+            capture = await self.scraper.take_screenshot(url, wait, viewport, full_page)
+            if not capture:
+                await self.safe_edit(message, "❌ Failed")
+                return
+            data = capture["data"]
+            await self.capture_cache.put(cache_key, data)
+            status = f"waited {capture['waited']:.2f}s"
+        await self.safe_edit(message, f"📸 Screenshot ({status}):")
+        await message.channel.send(file=discord.File(io.BytesIO(data), filename=f"screenshot.{image_extension(data)}"))
     
-    async def cmd_scrape(self, message, args):
-        if not args or not self.scraper:
-            await self.safe_edit(message, "❌ Provide URL" if args else "❌ Selenium not available")
+    @command(options={"--wait": "wait", "--select": "extra_selector"}, flags={"--fresh": "fresh", "--browser": "force_browser"}, lane="network")
+    async def cmd_scrape(self, message, args, wait=None, extra_selector=None, fresh=False, force_browser=False):
+        if not args:
+            await self.safe_edit(message, "❌ Provide URL")
+            return
+        try:
+            wait = parse_wait_strategy(wait, self.config.get("selenium", {}).get("wait_timeout", 15)) if wait else None
+        except ValueError as e:
+            await self.safe_edit(message, f"❌ {e}")
+            return
+        selectors = {"title": "title", "content": "body"}
+        if extra_selector:
+            selectors["select"] = extra_selector
+        try:
+            cache_key = CaptureCache.make_key("scrape", args[0], wait=wait or (self.scraper.wait_strategy if self.scraper else None), selectors=selectors, browser=force_browser)
+        except ValueError as e:
+            await self.safe_edit(message, f"❌ {e}")
             return
-        await self.safe_edit(message, "🔍 Scraping...")
-        result = await self.scraper.scrape_website_content(args[0], {"title": "title", "content": "body"})
-        if result:
-            content = f"📄 {args[0]}:\n"
-            for key, value in result.items():
+        cached = None if fresh else await self.capture_cache.get(cache_key)
+        if cached is not None:
+            scraped = json.loads(cached)
+            status = f"cached, {scraped['tier']}"
+        else:
+            self.progress(message, "🔍 Scraping...")
+            scraped = None if force_browser else await self.http_scraper.scrape(args[0], selectors)
+            if scraped and not scraped.pop("needs_browser"):
+                scraped["tier"] = "http"
+                status = f"⚡ http, {scraped['elapsed']:.2f}s"
+            elif self.scraper:
+                # Only the browser fallback competes with screenshots for a browser slot
+                async with self.scheduler.escalate("browser"):
+                    scraped = await self.scraper.scrape_website_content(args[0], selectors, wait)
+                if scraped:
+                    scraped["tier"] = "browser"
+                    status = f"🌐 browser, waited {scraped['waited']:.2f}s"
+            elif scraped:
+                # No browser to escalate to, so partial static results beat nothing
+                scraped["tier"] = "http"
+                status = f"⚡ http (partial), {scraped['elapsed']:.2f}s"
+            if scraped:
+                await self.capture_cache.put(cache_key, json.dumps(scraped).encode())
+        if scraped:
+            content = f"📄 {args[0]} ({status}):\n"
+            for key, value in scraped["results"].items():
                 if value:
                     content += f"**{key}**: {value[:300]}...\n"
             await self.safe_edit(message, content[:2000])
         else:
             await self.safe_edit(message, "❌ Failed")
     
+    @command()
+    async def cmd_cache(self, message, args):
+        action = args[0].lower() if args else "stats"
+        if action == "clear":
+            await self.capture_cache.clear()
+            await self.safe_edit(message, "✅ Capture cache cleared")
+            return
+        stats = self.capture_cache.stats
+        lookups = stats["hits"] + stats["misses"]
+        hit_rate = stats["hits"] / lookups * 100 if lookups else 0
+        await self.safe_edit(message, f"🗄️ Capture cache: {self.capture_cache.total_bytes / 1024 / 1024:.1f}/{self.capture_cache.max_bytes / 1024 / 1024:.0f} MB\n✅ {stats['hits']} hits | ❌ {stats['misses']} misses | {hit_rate:.0f}% hit rate\n💾 {stats['stores']} stored | 🗑️ {stats['evictions']} evicted")
+    
+    @command(lane="network", timeout=600)
     async def cmd_download(self, message, args):
-        if not args or not self.scraper:
-            await self.safe_edit(message, "❌ Provide URL" if args else "❌ Selenium not available")
+        if not args:
+            await self.safe_edit(message, "❌ Provide URL")
+            return
+        self.progress(message, "⬇️ Downloading...")
+        try:
+            result = await self.downloader.download(args[0])
+        except DownloadError as e:
+            await self.safe_edit(message, f"❌ {e}")
+            return
+        except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+            await self.safe_edit(message, f"❌ Failed: {e or type(e).__name__}")
+            return
+        summary = f"{format_size(result['bytes'])} in {result['seconds']:.2f}s ({format_size(result['throughput'])}/s, {result['segments']} segment{'s' if result['segments'] > 1 else ''})"
+        if result["bytes"] > self.config.get("upload_limit", 10 * 1024 * 1024):
+            keep = self.config.get("download", {}).get("keep_hours", 24)
+            await self.safe_edit(message, f"⬇️ Downloaded {summary}\n📁 Too large to upload, saved to `{result['path']}` (kept for {keep:g}h)")
             return
-        await self.safe_edit(message, "⬇️ Downloading...")
-        os.makedirs("temp", exist_ok=True)
-        filepath = f"temp/download_{int(time.time())}"
-        downloaded = await self.scraper.download_file(args[0], filepath)
-        if downloaded and os.path.exists(downloaded):
-            await self.safe_edit(message, "⬇️ Downloaded:")
-            await message.channel.send(file=discord.File(downloaded))
+        await self.safe_edit(message, f"⬇️ Downloaded {summary}:")
+        try:
+            await message.channel.send(file=discord.File(result["path"]))
+        finally:
+            try:
+                os.remove(result["path"])
+            except OSError:
+                pass
+    
+    def build_deletion_filters(self, message, author=None, before=None, after=None, contains=None):
+        """Translate purge options into engine filters; defaults to this account's own messages"""
+        filters = {"author": self.bot.user.id, "contains": contains.lower() if contains else None}
+        if author:
+            if author.lower() in ("all", "any"):
+                filters["author"] = None
+            elif message.mentions:
+                filters["author"] = message.mentions[0].id
+            elif author.strip("<@!>").isdigit():
+                filters["author"] = int(author.strip("<@!>"))
+        now = time.time()
+        if before:
+            filters["older_than"] = now - parse_duration(before)
+        if after:
+            filters["newer_than"] = now - parse_duration(after)
+        return filters
+    
+    async def run_deletion(self, message, amount, filters, resume=False):
+        channel = message.channel
+        try:
+            await message.delete()
+        except Exception:
+            pass
+        status = None
+        
+        async def progress(deleted, scanned, elapsed):
+            nonlocal status
+            text = f"🗑️ Deleting... {deleted}/{amount} ({scanned} scanned, {deleted / elapsed:.1f} msg/s)"
+            try:
+                if status is None:
+                    status = await channel.send(text)
+                else:
+                    self.edits.status(status, text)
+            except Exception:
+                pass
+        
+        result = await self.deletion_engine.run(channel, amount, filters, progress, resume)
+        if result["deleted"] > 0:
+            text = f"✅ Deleted {result['deleted']} messages in {result['seconds']:.1f}s ({result['rate']:.1f} msg/s, {result['indexed']} from index, {result['scanned']} scanned)"
         else:
-            await self.safe_edit(message, "❌ Failed")
+            text = f"❌ No matching messages deleted ({result['scanned']} scanned)"
+        try:
+            if status is None:
+                status = await channel.send(text)
+            else:
+                await self.edits.final(status, text)
+            await asyncio.sleep(3)
+            await status.delete()
+        except Exception:
+            pass
     
-    async def cmd_purge(self, message, args):
+    @command(options={"--author": "author", "--before": "before", "--after": "after", "--contains": "contains"}, lane="bulk")
+    async def cmd_purge(self, message, args, **filter_options):
         if not args:
             await self.safe_edit(message, "❌ Provide amount")
             return
+        if args[0].lower() == "resume":
+            jobs = await self.deletion_engine.get_jobs()
+            job = jobs.get(str(message.channel.id))
+            if not job:
+                await self.safe_edit(message, "❌ Nothing to resume in this channel")
+                return
+            await self.run_deletion(message, job["amount"], job["filters"], resume=True)
+            return
         try:
             amount = int(args[0])
             if amount <= 0:
                 await self.safe_edit(message, "❌ Amount > 0")
                 return
-            
-            # Delete command message first
-            try:
-                await message.delete()
-            except:
-                pass
-            
-            deleted_count = 0
-            
-            # Check if channel supports purge method
-            if hasattr(message.channel, 'purge') and callable(getattr(message.channel, 'purge', None)):
-                # Use purge for text channels
-                try:
-                    deleted = await message.channel.purge(limit=amount)
-                    deleted_count = len(deleted)
-                except AttributeError:
-                    # Fallback to manual deletion
-                    pass
-            
-            # If purge didn't work or channel doesn't support it, delete manually
-            if deleted_count == 0:
-                try:
-                    async for msg in message.channel.history(limit=amount + 1):
-                        if msg.author.id == self.bot.user.id:
-                            try:
-                                await msg.delete()
-                                deleted_count += 1
-                                await asyncio.sleep(0.2)  # Rate limit
-                            except:
-                                pass
-                except:
-                    pass
-            
-            if deleted_count > 0:
-                confirmation = await message.channel.send(f"✅ Deleted {deleted_count} messages")
-                await asyncio.sleep(3)
-                try:
-                    await confirmation.delete()
-                except:
-                    pass
-            else:
-                await message.channel.send("❌ Could not delete messages (channel may not support bulk deletion)")
-        except Exception as e:
+            filters = self.build_deletion_filters(message, **filter_options)
+        except ValueError as e:
             await self.safe_edit(message, f"❌ {str(e)}")
+            return
+        await self.run_deletion(message, amount, filters)
     
-    async def cmd_clear(self, message, args):
-        amount = int(args[0]) if args and args[0].isdigit() else 100
-        await self.cmd_purge(message, [str(amount)])
+    @command(options={"--author": "author", "--before": "before", "--after": "after", "--contains": "contains"}, lane="bulk")
+    async def cmd_clear(self, message, args, **filter_options):
+        amount = args[0] if args and (args[0].isdigit() or args[0].lower() == "resume") else "100"
+        await self.cmd_purge(message, [amount], **filter_options)
     
-    async def cmd_cleardm(self, message, args):
+    @command(options={"--before": "before", "--after": "after", "--contains": "contains"}, lane="bulk")
+    async def cmd_cleardm(self, message, args, **filter_options):
         if not args or not isinstance(message.channel, discord.DMChannel):
             await self.safe_edit(message, "❌ Provide amount")
             return
-        try:
-            amount = int(args[0]) + 1
-            deleted = await message.channel.purge(limit=amount)
-            await message.channel.send(f"✅ Deleted {len(deleted)} messages")
-        except Exception as e:
-            await self.safe_edit(message, f"❌ {str(e)}")
+        # Only our own messages can be deleted in DMs
+        await self.cmd_purge(message, args[:1], **filter_options)
     
+    @command(lane="bulk")
+    async def cmd_index(self, message, args):
+        if not self.message_index:
+            await self.safe_edit(message, "❌ Message index disabled")
+            return
+        action = args[0].lower() if args else "stats"
+        if action == "backfill":
+            try:
+                limit = int(args[1]) if len(args) > 1 else self.config.get("message_index", {}).get("backfill_limit", 1000)
+            except ValueError:
+                await self.safe_edit(message, "❌ Invalid limit")
+                return
+            self.progress(message, f"📇 Indexing up to {limit} messages...")
+            start = time.perf_counter()
+            result = await self.message_index.backfill(message.channel, self.bot.user.id, limit)
+            state = "✅ channel fully indexed" if result["complete"] else "⏸️ run `backfill` again to continue"
+            await self.safe_edit(message, f"📇 Scanned {result['scanned']} messages, indexed {result['found']} of ours in {time.perf_counter() - start:.1f}s\n{state}")
+        elif action == "compact":
+            dropped = await self.message_index.compact()
+            await self.safe_edit(message, f"🧹 Compacted index, dropped {dropped} deleted IDs")
+        else:
+            summary = await self.message_index.summary()
+            await self.safe_edit(message, f"📇 Message index: {summary['live']} live | {summary['tombstones']} deleted\n📁 {summary['complete']}/{summary['channels']} channels fully backfilled")
+    
+    @command(lane="bulk")
     async def cmd_spam(self, message, args):
         if len(args) < 2:
             await self.safe_edit(message, "❌ Usage: `spam <amount> <message>`")
@@ -665,6 +3488,7 @@ class CommandHandler:
         except Exception as e:
             await self.safe_edit(message, f"❌ {str(e)}")
     
+    @command()
     async def cmd_quickdelete(self, message, args):
         if not args:
             await self.safe_edit(message, "❌ Provide message")
@@ -674,12 +3498,14 @@ class CommandHandler:
         await asyncio.sleep(2)
         await sent.delete()
     
+    @command()
     async def cmd_autoreply(self, message, args):
         if not args:
             await self.safe_edit(message, "❌ Usage: `autoreply ON|OFF`")
             return
         await self.safe_edit(message, f"✅ Auto-reply: {args[0].upper()}")
     
+    @command()
     async def cmd_afk(self, message, args):
         if not args:
             await self.safe_edit(message, "❌ Usage: `afk ON|OFF [message]`")
@@ -689,36 +3515,51 @@ class CommandHandler:
         bot_user_id = self.bot.user.id
         if mode == "ON":
             self.afk_users[bot_user_id] = afk_message
+            self.persist("afk_users", {str(user_id): text for user_id, text in self.afk_users.items()})
+            self.refresh_filter()
             await self.safe_edit(message, f"✅ AFK: {afk_message}")
         elif mode == "OFF":
             self.afk_users.pop(bot_user_id, None)
+            self.persist("afk_users", {str(user_id): text for user_id, text in self.afk_users.items()})
+            self.refresh_filter()
             await self.safe_edit(message, "✅ AFK disabled")
     
+    @command(args=False)
     async def cmd_guildinfo(self, message):
         if not message.guild:
             await self.safe_edit(message, "❌ Server only")
             return
         guild = message.guild
+        owner = guild.owner
+        if owner is None and guild.owner_id:
+            # Owner isn't in the member cache, ask the API instead
+            try:
+                owner = await guild.fetch_member(guild.owner_id)
+            except Exception:
+                owner = None
         info = f"""📊 {guild.name}
 🆔 {guild.id}
-👑 {guild.owner.mention if guild.owner else 'N/A'}
+👑 {owner.mention if owner else (f'<@{guild.owner_id}>' if guild.owner_id else 'N/A')}
 👥 {guild.member_count}
 📅 {guild.created_at.strftime('%Y-%m-%d')}
 📁 {len(guild.channels)} channels"""
         await self.safe_edit(message, info)
     
+    @command(args=False)
     async def cmd_guildicon(self, message):
         if not message.guild or not message.guild.icon:
             await self.safe_edit(message, "❌ No icon")
             return
         await self.safe_edit(message, f"🖼️ {message.guild.icon.url}")
     
+    @command(args=False)
     async def cmd_guildbanner(self, message):
         if not message.guild or not message.guild.banner:
             await self.safe_edit(message, "❌ No banner")
             return
         await self.safe_edit(message, f"🎨 {message.guild.banner.url}")
     
+    @command(lane="network")
     async def cmd_guildrename(self, message, args):
         if not message.guild or not args:
             await self.safe_edit(message, "❌ Provide name")
@@ -729,18 +3570,53 @@ class CommandHandler:
         except Exception as e:
             await self.safe_edit(message, f"❌ {str(e)}")
     
+    @command(args=False, lane="bulk")
     async def cmd_fetchmembers(self, message):
         if not message.guild:
             await self.safe_edit(message, "❌ Server only")
             return
-        members = [str(m) for m in message.guild.members]
+        guild = message.guild
+        members = guild.members
+        if not guild.chunked and len(members) < (guild.member_count or 0):
+            # Member cache is partial (lazy loading or caching disabled), fetch from Discord
+            try:
+                members = await guild.fetch_members(cache=self.bot._connection.member_cache_flags.other, delay=0.5)
+            except Exception as e:
+                if not members:
+                    await self.safe_edit(message, f"❌ {str(e)}")
+                    return
+        members = [str(m) for m in members]
         member_list = "\n".join(members[:50])
         await self.safe_edit(message, f"👥 {len(members)} members:\n{member_list}")
     
+    @command(lane="network")
     async def cmd_usericon(self, message, args):
-        user = message.mentions[0] if message.mentions else message.author
+        user = message.mentions[0] if message.mentions else None
+        if user is None and args and args[0].isdigit():
+            user = self.bot.get_user(int(args[0]))
+            if user is None:
+                try:
+                    user = await self.bot.fetch_user(int(args[0]))
+                except Exception as e:
+                    await self.safe_edit(message, f"❌ {str(e)}")
+                    return
+        user = user or message.author
         await self.safe_edit(message, f"🖼️ {user.name}: {user.avatar.url if user.avatar else 'No avatar'}")
     
+    @command(args=False)
+    async def cmd_memstats(self, message):
+        loop = asyncio.get_running_loop()
+        # Sizing the sampled objects is the slow part, keep it off the event loop
+        stats = await loop.run_in_executor(None, estimate_caches, collect_cache_objects(self.bot))
+        lines = [f"{'cache':<10}{'entries':>9}{'~MB':>9}"]
+        for name, (count, size) in stats.items():
+            lines.append(f"{name:<10}{count:>9}{size / 1024 / 1024:>9.2f}")
+        rss = process_rss_bytes()
+        if rss:
+            lines.append(f"{'rss':<10}{'':>9}{rss / 1024 / 1024:>9.1f}")
+        await self.safe_edit(message, "🧠 Memory\n```\n" + "\n".join(lines) + "\n```")
+    
+    @command(lane="bulk")
     async def cmd_dmall(self, message, args):
         if not message.guild or not args:
             await self.safe_edit(message, "❌ Server only + message")
@@ -753,10 +3629,11 @@ class CommandHandler:
                     await member.send(text)
                     count += 1
                     await asyncio.sleep(1)
-                except:
+                except Exception:
                     pass
         await self.safe_edit(message, f"✅ Sent to {count} members")
     
+    @command(lane="bulk")
     async def cmd_sendall(self, message, args):
         if not message.guild or not args:
             await self.safe_edit(message, "❌ Server only + message")
@@ -768,33 +3645,41 @@ class CommandHandler:
                 await channel.send(text)
                 count += 1
                 await asyncio.sleep(0.5)
-            except:
+            except Exception:
                 pass
         await self.safe_edit(message, f"✅ Sent to {count} channels")
     
+    @command()
     async def cmd_playing(self, message, args):
         if not args:
             await self.safe_edit(message, "❌ Provide status")
             return
-        activity = discord.Game(name=" ".join(args))
+        activity = self.make_activity("playing", " ".join(args))
         await self.bot.change_presence(activity=activity)
+        self.persist("activity", {"type": "playing", "name": " ".join(args)})
         await self.safe_edit(message, f"✅ Playing: {' '.join(args)}")
     
+    @command()
     async def cmd_watching(self, message, args):
         if not args:
             await self.safe_edit(message, "❌ Provide status")
             return
-        activity = discord.Activity(type=discord.ActivityType.watching, name=" ".join(args))
+        activity = self.make_activity("watching", " ".join(args))
         await self.bot.change_presence(activity=activity)
+        self.persist("activity", {"type": "watching", "name": " ".join(args)})
         await self.safe_edit(message, f"✅ Watching: {' '.join(args)}")
     
+    @command(args=False)
     async def cmd_stopactivity(self, message):
         await self.bot.change_presence(activity=None)
+        self.persist("activity", None)
         await self.safe_edit(message, "✅ Activity cleared")
     
+    @command(args=False)
     async def cmd_gentoken(self, message):
         await self.safe_edit(message, f"🎫 `{generate_fake_token()}`")
     
+    @command(lane="network")
     async def cmd_hypesquad(self, message, args):
         if not args:
             await self.safe_edit(message, "❌ Usage: `hypesquad <bravery|brilliance|balance>`")
@@ -808,55 +3693,64 @@ class CommandHandler:
             token = self.bot.http.token if hasattr(self.bot.http, 'token') else self.config.get("token")
             headers = {"Authorization": token, "Content-Type": "application/json"}
             url = "https://discord.com/api/v9/hypesquad/online"
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, json={"house_id": houses[house]}, headers=headers) as response:
-                    if response.status == 204:
-                        await self.safe_edit(message, f"✅ HypeSquad: {house.capitalize()}")
-                    else:
-                        await self.safe_edit(message, f"❌ Failed: {response.status}")
+            async with self.http.post(url, json={"house_id": houses[house]}, headers=headers) as response:
+                if response.status == 204:
+                    await self.safe_edit(message, f"✅ HypeSquad: {house.capitalize()}")
+                else:
+                    await self.safe_edit(message, f"❌ Failed: {response.status}")
         except Exception as e:
             await self.safe_edit(message, f"❌ {str(e)}")
     
+    @command(args=False)
     async def cmd_nitro(self, message):
         code = "".join([random.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789") for _ in range(16)])
         await self.safe_edit(message, f"🎁 https://discord.gift/{code}")
     
+    @command()
     async def cmd_ascii(self, message, args):
         if not args:
             await self.safe_edit(message, "❌ Provide text")
             return
-        ascii_text = "\n".join([char.upper() for char in " ".join(args)])
-        await self.safe_edit(message, f"```\n{ascii_text}\n```")
+        await self.send_long(message, ascii_text(" ".join(args)), fence="```")
     
-    async def cmd_minesweeper(self, message, args):
+    @command(options={"--seed": "seed"})
+    async def cmd_minesweeper(self, message, args, seed=None):
         try:
-            width = min(max(int(args[0]) if args else 9, 2), 15)
-            height = min(max(int(args[1]) if len(args) > 1 else 9, 2), 15)
-            grid = [[":zero:" for _ in range(width)] for _ in range(height)]
-            grid_text = "\n".join(["".join(row) for row in grid])
-            await self.safe_edit(message, grid_text[:2000])
-        except:
-            await self.safe_edit(message, "❌ Error")
+            width = int(args[0]) if args else 9
+            height = int(args[1]) if len(args) > 1 else width
+            mines = int(args[2]) if len(args) > 2 else None
+            seed = int(seed) if seed is not None else random.randrange(1000000)
+        except ValueError:
+            await self.safe_edit(message, "❌ Usage: `minesweeper [width] [height] [mines] [--seed n]`")
+            return
+        requested = (width, height)
+        width, height = fit_minesweeper(width, height, reserve=120)
+        mines = min(max(mines if mines is not None else round(width * height * MINESWEEPER_DENSITY), 1), width * height - 1)
+        board = generate_minesweeper(width, height, mines, seed)
+        # Say so when the board had to shrink, rather than handing back a different size unannounced
+        note = f" (reduced from {requested[0]}x{requested[1]} to fit one message)" if (width, height) != requested else ""
+        await self.safe_edit(message, f"💣 {width}x{height} · {mines} mines · seed {seed}{note}\n{board}")
     
+    @command()
     async def cmd_leetpeek(self, message, args):
         if not args:
             await self.safe_edit(message, "❌ Provide text")
             return
-        leet_map = {'a': '4', 'e': '3', 'i': '1', 'o': '0', 's': '5', 't': '7', 'l': '1', 'g': '9'}
-        leet_text = "".join([leet_map.get(char.lower(), char) for char in " ".join(args)])
-        await self.safe_edit(message, leet_text)
+        await self.send_long(message, leet_text(" ".join(args)))
     
+    @command(lane="network")
     async def cmd_whremove(self, message, args):
         if not args:
             await self.safe_edit(message, "❌ Provide webhook URL")
             return
         try:
-            webhook = discord.Webhook.from_url(args[0], session=self.bot.http._HTTPClient__session)
+            webhook = discord.Webhook.from_url(args[0], session=self.http.session)
             await webhook.delete()
             await self.safe_edit(message, "✅ Deleted")
         except Exception as e:
             await self.safe_edit(message, f"❌ {str(e)}")
     
+    @command(args=False, lane="network")
     async def cmd_firstmessage(self, message):
         try:
             async for msg in message.channel.history(limit=1, oldest_first=True):
@@ -865,9 +3759,10 @@ class CommandHandler:
         except Exception as e:
             await self.safe_edit(message, f"❌ {str(e)}")
     
+    @command("testcommands", args=False, lane="bulk")
     async def cmd_test(self, message):
         """Test all commands (except Selenium-based) with random queries"""
-        await self.safe_edit(message, "🧪 Testing all commands... Check console for results.")
+        self.progress(message, "🧪 Testing all commands... Check console for results.")
         
         # Commands to test (excluding Selenium: screenshot, scrape, download)
         test_commands = {
@@ -926,15 +3821,8 @@ class CommandHandler:
                 continue
             
             try:
-                # Test the command handler
-                if cmd_name in ("ping", "uptime", "help", "guildinfo", "guildicon", 
-                              "guildbanner", "fetchmembers", "stopactivity", "gentoken", 
-                              "nitro", "firstmessage"):
-                    # Commands without args
-                    await handler(message)
-                else:
-                    # Commands with args
-                    await handler(message, test_args)
+                # Invokers know whether their command takes args
+                await handler(message, test_args)
                 
                 results["working"].append(cmd_name)
                 print(f"✅ PASSED: {cmd_name}")
@@ -960,10 +3848,7 @@ class CommandHandler:
             handler = self.command_map.get(cmd_name)
             if handler:
                 try:
-                    if cmd_name in ("usericon",):
-                        await handler(message, [])
-                    else:
-                        await handler(message, test_args)
+                    await handler(message, test_args)
                     results["working"].append(cmd_name)
                     print(f"✅ PASSED: {cmd_name}")
                 except Exception as e:
@@ -1004,11 +3889,13 @@ Check console for detailed results."""
 
 # ==================== BOT ====================
 class Bot:
-    def __init__(self):
+    def __init__(self, config=None, client=None):
+        """`config` defaults to load_config(); `client` replaces the discord.Client (bench.py passes a fake)"""
         patch_discord_state()
-        self.config = load_config()
+        self.config = config or load_config()
         self.token = self.config.get("token", "").strip() if self.config.get("token") else ""
         self.prefix = self.config.get("prefix", ".")
+        self.prefix_len = len(self.prefix)
         self.start_time = time.time()
         
         if not self.token or self.token == "YOUR_TOKEN_HERE" or len(self.token) < 10:
@@ -1017,11 +3904,32 @@ class Bot:
             print("   Example: TOKEN = 'your_discord_token_here'")
             sys.exit(1)
         
-        self.bot = discord.Client()
+        api_config = self.config.get("discord_api", {})
+        point_discord_at(api_config.get("base"), api_config.get("gateway"))
+        cache_config = self.config.get("client_cache", {})
+        self.rate_limits = RateLimitObserver()
+        self.metrics = CommandMetrics()
+        self.metrics.attach(self.rate_limits.trace)
+        self.bot = client or discord.Client(http_trace=self.rate_limits.trace, **build_client_options(cache_config))
+        if not cache_config.get("presences", True):
+            disable_presence_tracking(self.bot)
+        self.http_client = HTTPClient(self.config, [self.metrics.trace])
+        monitor_config = self.config.get("loop_monitor", {})
+        self.loop_monitor = LoopMonitor(monitor_config.get("interval", 0.1), monitor_config.get("threshold_ms", 100)) if monitor_config.get("enabled", True) else None
+        state_config = self.config.get("state", {})
+        self.state = StateStore(state_config.get("path", os.path.join("data", "state.json")), state_config.get("flush_delay", 0.5), state_config.get("compact_every", 200))
+        self.state.load()
+        startup_mark("state load")
         self.command_handler = CommandHandler(self.bot, self.config, self.start_time, self)
+        self.warmup_task = None
+        self.ready_once = False
+        startup_mark("bot init")
         self.setup_events()
     
     def setup_events(self):
+        message_filter = self.command_handler.message_filter
+        message_index = self.command_handler.message_index
+        
         @self.bot.event
         async def on_ready():
             print(f"✅ Logged in as {self.bot.user.name}#{self.bot.user.discriminator}")
@@ -1032,35 +3940,54 @@ class Bot:
             except:
                 pass
             print("=" * 50)
+            self.command_handler.refresh_filter()
+            if self.loop_monitor:
+                self.loop_monitor.start()
+            if not self.ready_once:
+                # Worker time in the default executor is charged to the command that queued it
+                asyncio.get_running_loop().set_default_executor(TimedThreadPoolExecutor())
+                metrics_config = self.config.get("metrics", {})
+                if metrics_config.get("port"):
+                    try:
+                        await self.metrics.start_server(metrics_config.get("host", "127.0.0.1"), metrics_config["port"])
+                        print(f"📈 Metrics on http://{metrics_config.get('host', '127.0.0.1')}:{metrics_config['port']}/metrics")
+                    except OSError as e:
+                        print(f"⚠️  Metrics endpoint unavailable: {e}")
+            if STARTUP_PROFILE and not self.ready_once:
+                startup_mark("login (READY)")
+                print_startup_profile()
+            self.ready_once = True
+            scraper = self.command_handler.scraper
+            if scraper and self.config.get("selenium", {}).get("prewarm", True):
+                self.warmup_task = asyncio.ensure_future(scraper.initialize_driver())
         
         @self.bot.event
         async def on_message(message):
-            if not message.content.startswith(self.prefix):
-                if message.author.id == self.bot.user.id:
-                    return
-                if message.author.id in self.command_handler.copycat_users:
+            if message_index and message.author.id == message_filter.self_id:
+                message_index.record(message)
+            route = message_filter.route(message)
+            if route == ROUTE_DROP:
+                return
+            if route == ROUTE_PASSIVE:
+                if message.author.id in message_filter.copycat_users:
                     try:
                         await message.channel.send(message.content)
                     except:
                         pass
-                if self.bot.user.mentioned_in(message) and self.bot.user.id in self.command_handler.afk_users:
+                if message_filter.afk and self.bot.user.mentioned_in(message):
                     try:
                         await message.reply(self.command_handler.afk_users[self.bot.user.id])
                     except:
                         pass
                 return
             
-            if message.author.id != self.bot.user.id:
-                remote_users = self.config.get("remote-users", [])
-                if remote_users and str(message.author.id) not in remote_users:
-                    return
-            
-            parts = message.content[len(self.prefix):].strip().split()
+            # split() with no separator already drops surrounding whitespace
+            parts = message.content[self.prefix_len:].split()
             if not parts:
                 return
             
             command = parts[0]
-            args = parts[1:] if len(parts) > 1 else []
+            args = parts[1:]
             
             try:
                 result = await self.command_handler.handle_command(message, command, args)
@@ -1069,12 +3996,22 @@ class Bot:
             except Exception as e:
                 try:
                     await self.command_handler.safe_edit(message, f"❌ Error: {str(e)}")
-                except:
+                except Exception:
                     pass
         
+        if message_index:
+            @self.bot.event
+            async def on_raw_message_delete(payload):
+                cached = payload.cached_message
+                if cached is None or cached.author.id == message_filter.self_id:
+                    message_index.forget([payload.message_id])
+            
+            @self.bot.event
+            async def on_raw_bulk_message_delete(payload):
+                message_index.forget(payload.message_ids)
+        
         @self.bot.event
         async def on_error(event, *args, **kwargs):
-            import traceback
             traceback.print_exc()
     
     def run(self):
@@ -1087,9 +4024,10 @@ class Bot:
             if self.command_handler.scraper:
                 asyncio.run(self.command_handler.scraper.cleanup())
         except Exception as e:
-            import traceback
             print(f"❌ Fatal: {e}")
             traceback.print_exc()
+        finally:
+            self.state.close()
 
 # ==================== MAIN ====================
 if __name__ == "__main__":